@@ -1,82 +1,160 @@
 import argparse
+import codecs
+import concurrent.futures
 import datetime
+import fnmatch
+import hashlib
+import itertools
+import json
 import logging
 import os
 import pathlib
 import re
 import shutil
+import sqlite3
+import threading
+import time
 
 import chardet
 
 
-def util_equal_sign_in_inf_line(s:str) -> bool:
-	quote = False
-	for c in s:
-		if c == '"':
-			quote = not quote
-		elif quote:
-			continue
-		elif c == '=':
-			return True
-	return False
+# [section] header line after a newline, the rest of the line is ignored
+INF_SECTION_RE = re.compile(r"\n[ \t]*\[([^\]\r\n]*)\][^\n]*")
+# key, = and value of a line with double quotes, ; and = in quotes are literal
+INF_QUOTED_LINE_RE = re.compile(r'((?:[^"=;]+|"[^"]*(?:"|$))*)(=)?((?:[^";]+|"[^"]*(?:"|$))*)')
+INF_CONTINUATION_RE = re.compile(r'\\[ \t]*\r?\n')
+INF_TOKEN_RE = re.compile(r"%([^%\s]*)%")
 
-def parse_inf(inf_path:str) -> dict:
+def decode_inf(inf_context:bytes, prefix:int=64*1024) -> str:
 	"""
-	parse a windows inf file as a diction.
-	[section] name lower.
-	without variable replace.
-	return {section: {key: value}, section: string}
+	decode inf bytes by BOM first, then as utf-16 without BOM if there are NUL bytes, then utf-8.
+	chardet only runs on the first `prefix` bytes if all fail.
 	"""
-	config = {}
-	section = None
-
-	with open(inf_path, "rb") as f:
-		inf_context = f.read()
-		inf_code = chardet.detect(inf_context)
-		lines = inf_context.decode(inf_code['encoding']).split('\n')
-
-	for line in lines:
-		line = line.split(";")[0].strip()
-
-		if not line:
-			continue
+	for bom, encoding in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")):
+		if inf_context.startswith(bom):
+			return inf_context.decode(encoding)
+	head = inf_context[:prefix]
+	if b"\x00" in head:
+		# NUL is valid utf-8, ascii text in utf-16 has it in the high byte of every char
+		odd_nuls, even_nuls = head[1::2].count(0), head[0::2].count(0)
+		encoding = "utf-16-le" if odd_nuls > even_nuls else "utf-16-be"
+		if max(odd_nuls, even_nuls) * 4 > len(head):
+			return inf_context.decode(encoding, errors="replace")
+	else:
+		try:
+			return inf_context.decode("utf-8")
+		except UnicodeDecodeError:
+			pass
+	inf_code = chardet.detect(inf_context[:prefix])
+	return inf_context.decode(inf_code['encoding'] or "latin-1", errors="replace")
+
+def tokenize_inf_body(body:str) -> list:
+	"""
+	[(key, value)] of the logical lines of a section body, key is None for lines without =.
+	comments are stripped and lines ending with `\\` are joined with the next line.
+	"""
+	if "\\" in body:
+		body = INF_CONTINUATION_RE.sub("", body)
+	entries = []
+	for line in body.split("\n"):
+		if '"' in line:
+			key, equal, value = INF_QUOTED_LINE_RE.match(line).groups()
+		else:
+			key, equal, value = line.split(";", 1)[0].partition("=")
+		if equal:
+			entries.append((key.strip(), value.strip()))
+		else:
+			key = key.strip()
+			if key:
+				entries.append((None, key))
+	return entries
 
-		if line.startswith("[") and line.endswith("]"):
-			section = line[1:-1].strip().lower()
-			if section in config:
-				logging.warning("parse_inf find repeat section [%s]." % section)
-			config[section] = {}
+def iter_inf_sections(text:str, wanted=None):
+	"""
+	yield (section name lower, [(key, value)]) in one pass over the inf text, key is None for lines without =.
+	the body of sections not in `wanted` is skipped without tokenizing, stop iterating to stop parsing.
+	"""
+	text = "\n" + text
+	matches = INF_SECTION_RE.finditer(text)
+	current = next(matches, None)
+	while current is not None:
+		following = next(matches, None)
+		section = current.group(1).strip().lower()
+		if wanted is None or section in wanted:
+			yield section, tokenize_inf_body(text[current.end():following.start() if following is not None else len(text)])
+		current = following
+
+def build_inf(sections) -> dict:
+	"""
+	collect (section, entries) as {section: {key: value}, section: string}.
+	repeated sections are merged.
+	"""
+	config = {}
+	for section, entries in sections:
+		if section in config:
+			logging.warning("parse_inf find repeat section [%s]." % section)
+		if entries and entries[0][0] is None and section != "strings":
+			lines = [value if key is None else "%s=%s" % (key, value) for key, value in entries]
+			config[section] = "\n".join(filter(None, [config.get(section) if type(config.get(section)) is str else None] + lines))
 			continue
-
-		if section == "Strings".lower():
-			key, value = line.split("=", 1)
-			key = key.strip()
-			if key in config[section]:
-				logging.warning("parse_inf find repeat key in [Strings] section.")
-			config[section][key] = value.strip()
+		values = config.setdefault(section, {})
+		if type(values) is str:
+			logging.warning("parse_inf find undefined format in [%s]." % section)
 			continue
-
-		if util_equal_sign_in_inf_line(line):
-			key, value = line.split("=", 1)
-			config[section][key.strip()] = value.strip()
-		else:
-			if not config[section]:
-				config[section] = line
-			elif type(config[section]) is str:
-				config[section] += '\n' + line
-			else:
+		for key, value in entries:
+			if key is None:
 				logging.warning("parse_inf find undefined format in [%s]." % section)
+			else:
+				if section == "strings" and key in values:
+					logging.warning("parse_inf find repeat key in [Strings] section.")
+				values[key] = value
+	return config
+
+def read_inf_text(inf_path:str) -> str:
+	with open(inf_path, "rb") as f:
+		return decode_inf(f.read())
 
+def parse_inf(inf_path:str, sections=None) -> dict:
+	"""
+	parse a windows inf file as a diction.
+	[section] name lower, only the `sections` if given.
+	without variable replace.
+	return {section: {key: value}, section: string}
+	"""
+	config = build_inf(iter_inf_sections(read_inf_text(inf_path), sections))
 	logging.debug("parse_inf(%s) complete." % inf_path)
 	return config
 
-def extra_version(inf:dict) -> (datetime.date, str):
-	verstr = inf["Version".lower()]["DriverVer"]
+def parse_inf_version(inf_path:str, text:str=None) -> dict:
+	"""
+	parse [Version] only, and [Strings] if [Version] has %variable%.
+	parsing stops as soon as they are read. `text` is the decoded file if already read.
+	"""
+	found = []
+	for section, entries in iter_inf_sections(read_inf_text(inf_path) if text is None else text, ("version", "strings")):
+		found.append((section, entries))
+		names = {name for name, _ in found}
+		if "version" in names and ("strings" in names or not any("%" in value for name, items in found if name == "version" for _, value in items)):
+			break
+	return build_inf(found)
+
+def string_map(strings:dict) -> dict:
+	"""
+	[Strings] keys lower cased, and values unquoted, for replace_strings.
+	"""
+	return {key.lower(): value[1:-1] if len(value) > 1 and value[0] == value[-1] == '"' else value for key, value in strings.items()}
 
-	if '%' in verstr:
-		for key, value in inf["Strings".lower()].items():
-			verstr = verstr.replace(f"%{key}%", value)
-	# replace variable
+def replace_strings(value:str, strings:dict) -> str:
+	"""
+	replace %variable% by one regex pass with a `string_map` lookup, %% is a literal %.
+	unknown variables are kept.
+	"""
+	if '%' not in value:
+		return value
+	return INF_TOKEN_RE.sub(lambda m: strings.get(m.group(1).lower(), m.group()) if m.group(1) else "%", value)
+
+def extra_version(inf:dict) -> (datetime.date, str):
+	verstr = replace_strings(inf["Version".lower()]["DriverVer"], string_map(inf.get("Strings".lower(), {})))
 
 	rd, version = verstr.split(",")
 	rd = datetime.datetime.strptime(rd.strip(), "%m/%d/%Y")
@@ -92,44 +170,190 @@ def get_inf_name(dirname:str) -> str:
 			return filename
 	return None
 
-def analyse_batch(drivers_dir:str) -> dict:
+def extra_inf_version(inf_path:str) -> (datetime.date, str):
+	return extra_version(parse_inf_version(inf_path))
+
+def extra_inf_meta(inf_path:str) -> (datetime.date, str, dict, list):
 	"""
-	analyse one driver-export directory.
+	return release date, version, the [Version] section with variables replaced and the sorted hardware ids.
+	"""
+	text = read_inf_text(inf_path)
+	inf = parse_inf_version(inf_path, text)
+	release_date, version = extra_version(inf)
+	strings = string_map(inf.get("Strings".lower(), {}))
+	fields = {}
+	if type(inf["Version".lower()]) is dict:
+		fields = {key: replace_strings(value, strings) for key, value in inf["Version".lower()].items()}
+	return release_date, version, fields, sorted(parse_hardware_ids(text))
+
+# bump when parse_inf or the cached columns change
+INF_CACHE_VERSION = 2
+
+class InfCache:
+	"""
+	sqlite cache of inf metadata.
+	a file is matched by (path, size, mtime) without reading it, then by its content hash,
+	so the same driver package in another export batch is parsed only once.
+	entries unused for `max_age` days are evicted on close.
+	"""
+	def __init__(self, db_path:str, max_age:float=90):
+		self.conn = sqlite3.connect(db_path)
+		# tables of another version of the inf parser are dropped
+		if self.conn.execute("PRAGMA user_version").fetchone()[0] != INF_CACHE_VERSION:
+			self.conn.executescript("""
+				DROP TABLE IF EXISTS files;
+				DROP TABLE IF EXISTS infos;
+				PRAGMA user_version = %d;
+			""" % INF_CACHE_VERSION)
+		self.conn.executescript("""
+			CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, used REAL);
+			CREATE TABLE IF NOT EXISTS infos (digest TEXT PRIMARY KEY, release_date TEXT, version TEXT, fields TEXT, hardware_ids TEXT, used REAL);
+		""")
+		self.max_age = max_age
+		self.now = time.time()
+
+	def lookup_path(self, inf_path:str, stat:os.stat_result) -> str:
+		row = self.conn.execute("SELECT digest FROM files WHERE path=? AND size=? AND mtime_ns=?",
+			(os.path.abspath(inf_path), stat.st_size, stat.st_mtime_ns)).fetchone()
+		return row[0] if row else None
+
+	def store_path(self, inf_path:str, stat:os.stat_result, digest:str):
+		self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+			(os.path.abspath(inf_path), stat.st_size, stat.st_mtime_ns, digest, self.now))
+
+	def lookup(self, digest:str) -> (datetime.date, str):
+		row = self.conn.execute("SELECT release_date, version FROM infos WHERE digest=?", (digest,)).fetchone()
+		if row is None:
+			return None
+		self.conn.execute("UPDATE infos SET used=? WHERE digest=?", (self.now, digest))
+		return datetime.datetime.fromisoformat(row[0]), row[1]
+
+	def store(self, digest:str, release_date:datetime.date, version:str, fields:dict, hardware_ids:list):
+		self.conn.execute("INSERT OR REPLACE INTO infos VALUES (?, ?, ?, ?, ?, ?)",
+			(digest, release_date.isoformat(), version, json.dumps(fields, ensure_ascii=False), json.dumps(hardware_ids), self.now))
+
+	def fields(self, inf_path:str) -> dict:
+		row = self.conn.execute("SELECT infos.fields FROM files JOIN infos ON files.digest = infos.digest WHERE files.path=?",
+			(os.path.abspath(inf_path),)).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def hardware_ids_by_driver(self) -> dict:
+		"""
+		{driver directory: set of hardware ids} of every cached inf file, in one query.
+		"""
+		rows = self.conn.execute("SELECT files.path, infos.hardware_ids FROM files JOIN infos ON files.digest = infos.digest")
+		return {os.path.dirname(path): set(json.loads(hardware_ids)) for path, hardware_ids in rows}
+
+	def evict(self):
+		deadline = self.now - self.max_age * 86400
+		self.conn.execute("DELETE FROM infos WHERE used < ?", (deadline,))
+		self.conn.execute("DELETE FROM files WHERE used < ? OR digest NOT IN (SELECT digest FROM infos)", (deadline,))
+
+	def close(self):
+		self.evict()
+		self.conn.commit()
+		self.conn.close()
+
+def run_map(fn, items:list, jobs:int=1) -> list:
+	if jobs > 1 and len(items) > 1:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+			return list(executor.map(fn, items, chunksize=16))
+	return list(map(fn, items))
+
+def analyse_infs(inf_paths:list, jobs:int=1, cache:InfCache=None) -> list:
+	"""
+	return [(release_date, version)] of inf files in the same order.
+	only inf files missed by the cache are parsed, in a process pool if jobs > 1.
+	"""
+	if cache is None:
+		return run_map(extra_inf_version, inf_paths, jobs)
+
+	results = [None] * len(inf_paths)
+	todo = {}
+	for i, inf_path in enumerate(inf_paths):
+		stat = os.stat(inf_path)
+		digest = cache.lookup_path(inf_path, stat)
+		if digest is None:
+			with open(inf_path, "rb") as f:
+				digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+		cache.store_path(inf_path, stat, digest)
+		results[i] = cache.lookup(digest)
+		if results[i] is None:
+			todo.setdefault(digest, []).append(i)
+
+	metas = run_map(extra_inf_meta, [inf_paths[indexes[0]] for indexes in todo.values()], jobs)
+	for (digest, indexes), (release_date, version, fields, hardware_ids) in zip(todo.items(), metas):
+		cache.store(digest, release_date, version, fields, hardware_ids)
+		for i in indexes:
+			results[i] = (release_date, version)
+	logging.info("analyse_infs parsed %d of %d inf files." % (len(todo), len(inf_paths)))
+	return results
+
+def scan_batch(drivers_dir:str) -> list:
+	"""
+	find the inf file of every driver in one driver-export directory.
+	return [(device, hash, driver_path, inf_path)]
+	"""
+	entries = []
+	with os.scandir(drivers_dir) as it:
+		for entry in it:
+			if not entry.is_dir():
+				continue
+			prefix, suffix = entry.name.split(".")
+			inf_name = get_inf_name(entry.path)
+			if inf_name is None:
+				logging.error("get_inf_name failed of %s." % entry.name)
+				continue
+			entries.append((prefix, suffix, entry.path, os.path.join(entry.path, inf_name)))
+	return entries
+
+def collect_batch(drivers_dir:str, entries:list, versions) -> dict:
+	"""
+	pair scan_batch entries with their (release_date, version) in the same order.
 	return {device: [(date, version, hash, path)]}
 	"""
-	dirs = os.listdir(drivers_dir)
 	driver_info = {}
-
-	for dirname in dirs:
-		prefix, suffix = dirname.split(".")
-		inf_name = get_inf_name(os.path.join(drivers_dir, dirname))
-		if inf_name is None:
-			logging.error("get_inf_name failed of %s." % dirname)
-			continue
-		inf_path = os.path.join(drivers_dir, dirname, inf_name)
-		inf_config = parse_inf(inf_path)
-		release_date, version = extra_version(inf_config)
+	for (prefix, suffix, driver_path, inf_path), (release_date, version) in zip(entries, versions):
 		driver_info[prefix] = driver_info.get(prefix, [])
-		driver_info[prefix].append((release_date, version, suffix, os.path.join(drivers_dir, dirname)))
+		driver_info[prefix].append((release_date, version, suffix, driver_path))
 
 	logging.info("analyse_batch(%s) find %d kinds of device drivers." % (drivers_dir, len(driver_info)))
 	return driver_info
 
-def analyse_multibatch(drivers_dirs:list) -> dict:
+def analyse_batch(drivers_dir:str, cache:InfCache=None) -> dict:
+	"""
+	analyse one driver-export directory.
+	return {device: [(date, version, hash, path)]}
+	"""
+	entries = scan_batch(drivers_dir)
+	return collect_batch(drivers_dir, entries, analyse_infs([entry[3] for entry in entries], cache=cache))
+
+def merge_batch(driver_stat:dict, batch_info:dict):
+	for device, info in batch_info.items():
+		driver_stat[device] = driver_stat.get(device, {})
+		for item in info:
+			version = item[1]
+			driver_stat[device][version] = driver_stat[device].get(version, [])
+			driver_stat[device][version].append((item[0], item[2], item[3]))
+
+def analyse_multibatch(drivers_dirs:list, jobs:int=1, cache:InfCache=None) -> dict:
 	"""
 	combine multi directories exported driver infomation.
+	with jobs > 1, directories are scanned in threads and inf files are parsed in a process pool,
+	the result is the same as the serial one.
 	driver_stat: {device: {version: [(release_date, hash, path)]}}
 	"""
 	driver_stat = {}
 
-	for batch_dir in drivers_dirs:
-		batch_info = analyse_batch(batch_dir)
-		for device, info in batch_info.items():
-			driver_stat[device] = driver_stat.get(device, {})
-			for item in info:
-				version = item[1]
-				driver_stat[device][version] = driver_stat[device].get(version, [])
-				driver_stat[device][version].append((item[0], item[2], item[3]))
+	if jobs > 1:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as threads:
+			batches = list(threads.map(scan_batch, drivers_dirs))
+	else:
+		batches = [scan_batch(batch_dir) for batch_dir in drivers_dirs]
+	inf_paths = [entry[3] for entries in batches for entry in entries]
+	versions = iter(analyse_infs(inf_paths, jobs=jobs, cache=cache))
+	for batch_dir, entries in zip(drivers_dirs, batches):
+		merge_batch(driver_stat, collect_batch(batch_dir, entries, itertools.islice(versions, len(entries))))
 
 	logging.info("analyse_multibatch(%s) find %d kinds of device drivers." % (drivers_dirs, len(driver_stat)))
 	return driver_stat
@@ -145,7 +369,7 @@ def print_driver_stat(driver_stat:dict, path_cut:int=10):
 
 	for device in devices:
 		print(device)
-		for version in sorted(driver_stat[device].keys()):
+		for version in sorted(driver_stat[device].keys(), key=parse_version):
 			print("\t%s" % version)
 			for item in driver_stat[device][version]:
 				date = item[0].strftime("%Y%m%d")
@@ -162,11 +386,177 @@ def print_driver_stat(driver_stat:dict, path_cut:int=10):
 	print("\t%d have multi drivers." % multi_cnt)
 	print("\t%d extra with some error." % none_cnt)
 
-def execute(driver_stat:dict, dst_dir:str, method:str="copy", exclude_prefix:list=[]):
+def file_digest(path:str) -> str:
+	with open(path, "rb") as f:
+		return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+def reflink(src:str, dst:str) -> bool:
+	try:
+		import fcntl
+		with open(src, "rb") as fs, open(dst, "wb") as fd:
+			fcntl.ioctl(fd.fileno(), 0x40049409, fs.fileno())
+		return True
+	except (ImportError, OSError):
+		return False
+# FICLONE ioctl, share extents on btrfs/xfs without copying data
+
+def copy_file(src:str, dst:str):
+	"""
+	copy by reflink, then copy_file_range, then a plain copy, with metadata like copy2.
+	"""
+	if not reflink(src, dst):
+		try:
+			with open(src, "rb") as fs, open(dst, "wb") as fd:
+				remain = os.fstat(fs.fileno()).st_size
+				while remain > 0:
+					n = os.copy_file_range(fs.fileno(), fd.fileno(), remain)
+					if n == 0:
+						break
+					remain -= n
+		except (AttributeError, OSError):
+			shutil.copyfile(src, dst)
+	shutil.copystat(src, dst)
+
+class DedupStore:
+	"""
+	content-addressed store in `dst_dir/.objects`.
+	every file is hashed once, files of the same content are hard links to one object,
+	or reflinks/copies of it when hard links are not supported.
+	storing into the same dst_dir again only adds the new content, files already linked are kept.
+	"""
+	def __init__(self, dst_dir:str):
+		self.objects_dir = os.path.join(dst_dir, ".objects")
+		self.lock = threading.Lock()
+		self.ready = {}
+		self.saved = 0
+
+	def put(self, src:str, dst:str):
+		digest = file_digest(src)
+		obj = os.path.join(self.objects_dir, digest[:2], digest)
+		with self.lock:
+			future = self.ready.get(digest)
+			owner = future is None
+			if owner:
+				future = self.ready[digest] = concurrent.futures.Future()
+
+		if owner:
+			try:
+				created = not os.path.exists(obj)
+				if created:
+					os.makedirs(os.path.dirname(obj), exist_ok=True)
+					tmp = "%s.%d.tmp" % (obj, threading.get_ident())
+					copy_file(src, tmp)
+					os.replace(tmp, obj)
+				future.set_result(created)
+			except BaseException as e:
+				future.set_exception(e)
+				raise
+		else:
+			future.result()
+			created = False
+
+		if os.path.exists(dst):
+			if os.path.samefile(obj, dst) or (os.path.getsize(dst) == os.path.getsize(obj) and file_digest(dst) == digest):
+				return
+			# a changed file of a driver stored before, replaced atomically
+			tmp = "%s.%d.tmp" % (dst, threading.get_ident())
+			self.link(obj, tmp)
+			os.replace(tmp, dst)
+		else:
+			self.link(obj, dst)
+		if not created:
+			with self.lock:
+				self.saved += os.path.getsize(obj)
+
+	@staticmethod
+	def link(obj:str, dst:str):
+		try:
+			os.link(obj, dst)
+		except OSError:
+			copy_file(obj, dst)
+
+	def put_tree(self, src_dir:str, dst_dir:str, executor) -> list:
+		"""
+		submit every file of src_dir to executor, directories are created at once.
+		"""
+		futures = []
+		os.makedirs(dst_dir, exist_ok=True)
+		for root, dirs, files in os.walk(src_dir):
+			target = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+			for dirname in dirs:
+				os.makedirs(os.path.join(target, dirname), exist_ok=True)
+			for fn in files:
+				futures.append(executor.submit(self.put, os.path.join(root, fn), os.path.join(target, fn)))
+		return futures
+
+def store_drivers(driver_paths:list, dst_dir:str, threads:int=8) -> int:
+	"""
+	store driver directories into dst_dir through a DedupStore with a thread pool.
+	return the bytes saved by deduplication.
+	"""
+	store = DedupStore(dst_dir)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+		futures = []
+		for driver_path in driver_paths:
+			futures += store.put_tree(driver_path, os.path.join(dst_dir, os.path.split(driver_path)[-1]), executor)
+		for future in futures:
+			future.result()
+	return store.saved
+
+def parse_version(version:str) -> tuple:
+	return tuple(int(part) for part in re.findall(r"\d+", version))
+# "10.0.10" --> (10, 0, 10), so 10.0.10 > 10.0.9
+
+def extra_hardware_ids(inf_path:str) -> set:
+	return parse_hardware_ids(read_inf_text(inf_path))
+
+def parse_hardware_ids(text:str) -> set:
+	"""
+	hardware ids listed in the model sections of [Manufacturer] of the inf text, upper case.
+	"""
+	models = set()
+	for _, entries in iter_inf_sections(text, ("manufacturer",)):
+		for key, value in entries:
+			if key is not None:
+				parts = [part.strip().lower() for part in value.split(",")]
+				models.update([parts[0]] + ["%s.%s" % (parts[0], decoration) for decoration in parts[1:]])
+
+	hardware_ids = set()
+	for _, entries in iter_inf_sections(text, models):
+		for key, value in entries:
+			if key is not None:
+				ids = value.split(",")[1:]
+				hardware_ids.update(hwid.strip().upper() for hwid in ids if hwid.strip())
+	return hardware_ids
+
+def driver_hardware_ids(driver_path:str, hardware_ids:dict) -> set:
+	ids = hardware_ids.get(os.path.abspath(driver_path))
+	if ids is None:
+		ids = extra_hardware_ids(os.path.join(driver_path, get_inf_name(driver_path)))
+	return ids
+
+def select_drivers(driver_stat:dict, exclude_prefix:list=[], policy:str="newest-date", pins:dict=None, hwid_patterns:list=None, hardware_ids:dict=None) -> (list, int):
+	"""
+	select one driver of every device in one pass over the candidates.
+	policy newest-date orders by (release_date, version), highest-version by (version, release_date).
+	versions are compared as integer tuples. a device in `pins` selects the pinned version.
+	with hwid_patterns, only drivers with a matching hardware id are candidates.
+	hardware ids are taken from `hardware_ids` {driver directory: ids}(see InfCache), inf files missing from it are parsed.
+	flag is True if the selected driver is not also the best one by the other key.
+	return (candidate_list, exclude_cnt)
+	candidate_list: [(device, release_date, version, hash, path, flag)]
+	"""
+	pins = pins or {}
+	hardware_ids = hardware_ids or {}
 	candidate_list = []
 	exclude_cnt = 0
 	if exclude_prefix:
 		exclude_pattern = re.compile(r"^(%s)" % "|".join(map(re.escape, exclude_prefix)))
+	if hwid_patterns:
+		hwid_pattern = re.compile("|".join(fnmatch.translate(pattern.upper()) for pattern in hwid_patterns))
+	by_date = lambda item: (item[0], item[4])
+	by_version = lambda item: (item[4], item[0])
+	primary, secondary = (by_version, by_date) if policy == "highest-version" else (by_date, by_version)
 
 	for device in driver_stat:
 		if exclude_prefix:
@@ -175,38 +565,134 @@ def execute(driver_stat:dict, dst_dir:str, method:str="copy", exclude_prefix:lis
 				logging.info("execute %s is exclude by prefix rule." % device)
 				continue
 
-		version_max = ""
-		release_latest = None
-		selected = None
-		for version in driver_stat[device]:
-			for item in driver_stat[device][version]:
-				if not release_latest or release_latest < item[0]:
-					selected = (device, item[0], version, item[1], item[2], version<version_max)
-					if version < version_max:
-						logging.warning("%s drivers occur more recent with less version." % device)
-						logging.warning("version %s less than %s, but release date %s is newer than %s." % (version, version_max, item[0], release_latest))
-					release_latest = item[0]
-					version_max = version
-
-			if version > version_max:
-				version_max = version
-		candidate_list.append(selected)
+		candidates = [(item[0], version, item[1], item[2], parse_version(version)) for version, items in driver_stat[device].items() for item in items]
+		# (release_date, version, hash, path, version_key)
+		if hwid_patterns:
+			candidates = [item for item in candidates if any(hwid_pattern.match(hwid) for hwid in driver_hardware_ids(item[3], hardware_ids))]
+			if not candidates:
+				exclude_cnt += 1
+				logging.info("execute %s is exclude by hardware id rule." % device)
+				continue
+		if device in pins:
+			pinned = [item for item in candidates if item[1] == pins[device]]
+			if pinned:
+				candidates = pinned
+			else:
+				logging.warning("%s has no pinned version %s, select by %s." % (device, pins[device], policy))
+
+		selected = max(candidates, key=primary)
+		best = max(candidates, key=secondary)
+		flag = secondary(selected) < secondary(best)
+		if flag:
+			logging.warning("%s drivers occur %s." % (device, "more recent with less version" if primary is by_date else "higher version with older release"))
+			logging.warning("selected version %s released %s, but version %s released %s." % (selected[1], selected[0], best[1], best[0]))
+		candidate_list.append((device, selected[0], selected[1], selected[2], selected[3], flag))
+	return candidate_list, exclude_cnt
+
+def save_plan(plan_path:str, candidate_list:list):
+	plan = [{"device": item[0], "release_date": item[1].isoformat(), "version": item[2], "hash": item[3], "path": str(item[4]), "flag": item[5]} for item in candidate_list]
+	with open(plan_path, "w", encoding="utf-8") as f:
+		json.dump(plan, f, ensure_ascii=False, indent=1)
+
+def load_plan(plan_path:str) -> list:
+	with open(plan_path, encoding="utf-8") as f:
+		plan = json.load(f)
+	return [(item["device"], datetime.datetime.fromisoformat(item["release_date"]), item["version"], item["hash"], item["path"], item["flag"]) for item in plan]
+
+def write_json_atomic(path:str, data):
+	tmp_path = "%s.tmp" % path
+	with open(tmp_path, "w", encoding="utf-8") as f:
+		json.dump(data, f, ensure_ascii=False, indent=1)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp_path, path)
+
+def sync_drivers(candidate_list:list, dst_dir:str, prune:bool=False, threads:int=8) -> dict:
+	"""
+	incremental copy driven by `dst_dir/manifest.json` {device: {release_date, version, hash, dirname}}.
+	only drivers whose selected (version, release date) changed are copied, the old copy is replaced.
+	drivers of devices not selected any more are removed if prune is True.
+	the manifest is rewritten atomically at the end.
+	return counts of {"copy", "replace", "prune", "unchanged"}
+	"""
+	manifest_path = os.path.join(dst_dir, "manifest.json")
+	manifest = {}
+	if os.path.exists(manifest_path):
+		with open(manifest_path, encoding="utf-8") as f:
+			manifest = json.load(f)
+
+	stat = {"copy": 0, "replace": 0, "prune": 0, "unchanged": 0}
+	new_manifest = {}
+	todo = []
+	for device, release_date, version, driver_hash, path, flag in candidate_list:
+		entry = {"release_date": release_date.isoformat(), "version": version, "hash": driver_hash, "dirname": os.path.split(path)[-1]}
+		old = manifest.get(device)
+		if old and (old["release_date"], old["version"]) == (entry["release_date"], entry["version"]) and os.path.isdir(os.path.join(dst_dir, old["dirname"])):
+			new_manifest[device] = old
+			stat["unchanged"] += 1
+			continue
+		todo.append((device, path, entry, old))
+
+	def replace(path:str, entry:dict, old:dict):
+		target = os.path.join(dst_dir, entry["dirname"])
+		tmp_target = target + ".tmp"
+		if os.path.exists(tmp_target):
+			shutil.rmtree(tmp_target)
+		shutil.copytree(path, tmp_target, copy_function=shutil.copy2)
+		if old and os.path.isdir(os.path.join(dst_dir, old["dirname"])):
+			shutil.rmtree(os.path.join(dst_dir, old["dirname"]))
+		if os.path.exists(target):
+			shutil.rmtree(target)
+		os.rename(tmp_target, target)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+		futures = [executor.submit(replace, path, entry, old) for device, path, entry, old in todo]
+		for (device, path, entry, old), future in zip(todo, futures):
+			future.result()
+			new_manifest[device] = entry
+			stat["replace" if old else "copy"] += 1
+			logging.info("sync %s %s %s." % ("replace" if old else "copy", device, entry["dirname"]))
+
+	for device, old in manifest.items():
+		if device in new_manifest:
+			continue
+		if prune:
+			if os.path.isdir(os.path.join(dst_dir, old["dirname"])):
+				shutil.rmtree(os.path.join(dst_dir, old["dirname"]))
+			stat["prune"] += 1
+			logging.info("sync prune %s %s." % (device, old["dirname"]))
+		else:
+			new_manifest[device] = old
+
+	write_json_atomic(manifest_path, new_manifest)
+	return stat
+
+def execute(driver_stat:dict, dst_dir:str, method:str="copy", exclude_prefix:list=[], threads:int=8, assume_yes:bool=False, candidate_list:list=None, prune:bool=False, **select_options):
+	"""
+	copy/move/store/sync selected drivers to dst_dir.
+	candidate_list from a plan is used instead of selecting from driver_stat if given.
+	assume_yes skips all confirmations.
+	select_options are passed to select_drivers.
+	"""
+	exclude_cnt = 0
+	if candidate_list is None:
+		candidate_list, exclude_cnt = select_drivers(driver_stat, exclude_prefix, **select_options)
 
 	print("--------------- Select Result ---------------")
 	for item in candidate_list:
 		print("%s will select %s %s from %s.%s" % (item[0], item[1].strftime("%Y%m%d"), item[2], item[4], "\033[91m Note!\033[0m" if item[5] else ""))
 	# candidate_list(device, release_date, version, hash, path, flag)
-	if exclude_prefix:
-		print("%d device drivers are excluded by prefix rule." % exclude_cnt)
+	if exclude_prefix or select_options.get("hwid_patterns"):
+		print("%d device drivers are excluded by prefix or hardware id rule." % exclude_cnt)
 
-	ans = input("Are you sure %s these %d drivers to %s?(Yes/No)" % (method, len(candidate_list), dst_dir))
+	ans = "Yes" if assume_yes else input("Are you sure %s these %d drivers to %s?(Yes/No)" % (method, len(candidate_list), dst_dir))
 	if ans != "Yes":
 		logging.info("execute be canceled by user.")
 		print("execute be canceled by user.")
 		return 0
 	else:
 		if not os.path.exists(dst_dir):
-			mkd = input("The destination directory is not exist.\nContinue with y/yes:")
+			mkd = "yes" if assume_yes else input("The destination directory is not exist.\nContinue with y/yes:")
 			if mkd.lower() == "y" or  mkd.lower() == "yes":
 				os.makedirs(dst_dir)
 			else:
@@ -222,6 +708,12 @@ def execute(driver_stat:dict, dst_dir:str, method:str="copy", exclude_prefix:lis
 			for item in candidate_list:
 				shutil.move(item[4], dst_dir)
 			print("Move %d drivers to %s success." % (len(candidate_list), dst_dir))
+		elif method == "store":
+			saved = store_drivers([item[4] for item in candidate_list], dst_dir, threads=threads)
+			print("Store %d drivers to %s success, %d bytes saved by deduplication." % (len(candidate_list), dst_dir, saved))
+		elif method == "sync":
+			stat = sync_drivers(candidate_list, dst_dir, prune=prune, threads=threads)
+			print("Sync %d drivers to %s success, %d copied, %d replaced, %d pruned, %d unchanged." % (len(candidate_list), dst_dir, stat["copy"], stat["replace"], stat["prune"], stat["unchanged"]))
 		else:
 			logging.warn("undefined method.")
 			return -1
@@ -235,11 +727,37 @@ if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Collect the latest version windows driver of devices from some dism export directories.\nYou can export drivers use `dism /online /export-driver /destination:C:\MyDrivers` in windows terminal.")
 	parser.add_argument("-s", "--src", action="extend", nargs="+", type=pathlib.Path)
 	parser.add_argument("-d", "--dst", default="LatestDrivers", type=pathlib.Path, help="Where to collect the selected drivers.")
-	parser.add_argument("-m", "--method", default="copy", choices=["copy", "move"])
+	parser.add_argument("-m", "--method", default="copy", choices=["copy", "move", "store", "sync"], help="store deduplicates files by content with hard links, sync only copies changed drivers.")
 	parser.add_argument("--exclude-prefix", action="extend", nargs="+", type=str, help="Exclude devices driver with the prefix.")
 	parser.add_argument("--print-cut", default=10, type=int, help="Cut too long path in print.")
+	parser.add_argument("-j", "--jobs", default=1, type=int, help="Parse inf files in JOBS processes.")
+	parser.add_argument("--cache", default=None, type=pathlib.Path, help="Sqlite file to cache parsed inf metadata between runs.")
+	parser.add_argument("--cache-max-age", default=90, type=float, help="Evict cache entries unused for so many days.")
+	parser.add_argument("--threads", default=8, type=int, help="Copy threads of the store and sync method.")
+	parser.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation.")
+	parser.add_argument("--plan", default=None, type=pathlib.Path, help="Execute a saved selection plan without asking, --src is not analysed.")
+	parser.add_argument("--plan-out", default=None, type=pathlib.Path, help="Save the selection plan to this file and exit.")
+	parser.add_argument("--prune", action="store_true", help="Sync removes drivers of devices which are not selected any more.")
+	parser.add_argument("--policy", default="newest-date", choices=["newest-date", "highest-version"], help="How to select the driver of a device.")
+	parser.add_argument("--pin", action="extend", nargs="+", default=[], type=str, help="Select the version of a device, as DEVICE=VERSION.", metavar="DEVICE=VERSION")
+	parser.add_argument("--hwid", action="extend", nargs="+", type=str, help="Only select drivers listing a hardware id matching these glob patterns.")
 	args = parser.parse_args()
-
-	driver_stat = analyse_multibatch(args.src)
+	select_options = {"policy": args.policy, "pins": dict(pin.split("=", 1) for pin in args.pin), "hwid_patterns": args.hwid}
+
+	if args.plan:
+		ret = execute(None, args.dst, method=args.method, threads=args.threads, assume_yes=True, candidate_list=load_plan(args.plan), prune=args.prune)
+		exit(ret)
+
+	cache = InfCache(args.cache, max_age=args.cache_max_age) if args.cache else None
+	driver_stat = analyse_multibatch(args.src, jobs=args.jobs, cache=cache)
+	if cache:
+		if args.hwid:
+			select_options["hardware_ids"] = cache.hardware_ids_by_driver()
+		cache.close()
 	print_driver_stat(driver_stat, path_cut=args.print_cut)
-	ret = execute(driver_stat, args.dst, method=args.method, exclude_prefix=args.exclude_prefix)
+	if args.plan_out:
+		candidate_list, exclude_cnt = select_drivers(driver_stat, args.exclude_prefix, **select_options)
+		save_plan(args.plan_out, candidate_list)
+		print("Save the plan of %d drivers to %s." % (len(candidate_list), args.plan_out))
+		exit(0)
+	ret = execute(driver_stat, args.dst, method=args.method, exclude_prefix=args.exclude_prefix, threads=args.threads, assume_yes=args.yes, prune=args.prune, **select_options)
@@ -0,0 +1,492 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from typing import List, Dict, Tuple, Callable
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# bump when a generator changes, cached fixtures of other versions are generated again
+FIXTURE_VERSION = 3
+MB = 1024 * 1024
+
+def fixture_ndjson(root:str, scale:float, rnd:random.Random) -> Tuple[int, int]:
+	"""
+	nested event records of about 64MB per scale, keys vary between records like real exports.
+	"""
+	path = os.path.join(root, "events.ndjson")
+	target = int(64 * MB * scale)
+	events = ["click", "view", "purchase", "signup", "logout"]
+	countries = ["CN", "US", "DE", "JP", "BR", "IN", "FR"]
+	written = count = 0
+	with open(path, "w", encoding="utf-8", newline="\n") as f:
+		lines = []
+		while written < target:
+			record = {
+				"id": count,
+				"ts": (datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=count * 7)).isoformat(),
+				"event": rnd.choice(events),
+				"user": {"name": "user%06d" % rnd.randrange(1000000), "age": rnd.randint(16, 80), "country": rnd.choice(countries)},
+				"value": round(rnd.random() * 1000, 3),
+				"ok": rnd.random() < 0.9,
+				"tags": rnd.sample(events, rnd.randint(0, 3)),
+			}
+			if count % 7 == 0:
+				record["referrer"] = "https://example.com/p/%d" % rnd.randrange(10000)
+			if count % 13 == 0:
+				record["user"]["vip"] = {"level": rnd.randint(1, 5), "since": "20%02d" % rnd.randint(10, 24)}
+			line = json.dumps(record, ensure_ascii=False) + "\n"
+			lines.append(line)
+			written += len(line)
+			count += 1
+			if len(lines) >= 4096:
+				f.write("".join(lines))
+				lines.clear()
+		f.write("".join(lines))
+	return written, count
+
+def mp4_box(tp:str, payload:bytes=b"") -> bytes:
+	return struct.pack(">I4s", 8 + len(payload), tp.encode("ascii")) + payload
+
+def mp4_full_box(tp:str, version:int, payload:bytes, flags:int=0) -> bytes:
+	return mp4_box(tp, struct.pack(">I", version << 24 | flags) + payload)
+
+def mp4_trak(track_id:int, sizes:List[int], chunk_offsets:List[int], samples_per_chunk:int) -> bytes:
+	n = len(sizes)
+	stsd = mp4_full_box("stsd", 0, struct.pack(">I", 1) + mp4_box("avc1", b"\0" * 78))
+	stts = mp4_full_box("stts", 0, struct.pack(">III", 1, n, 512))
+	stsc = mp4_full_box("stsc", 0, struct.pack(">IIII", 1, 1, samples_per_chunk, 1))
+	stsz = mp4_full_box("stsz", 0, struct.pack(">II%dI" % n, 0, n, *sizes))
+	stco = mp4_full_box("stco", 0, struct.pack(">I%dI" % len(chunk_offsets), len(chunk_offsets), *chunk_offsets))
+	keyframes = range(1, n + 1, 30)
+	stss = mp4_full_box("stss", 0, struct.pack(">I%dI" % len(keyframes), len(keyframes), *keyframes))
+	stbl = mp4_box("stbl", stsd + stts + stsc + stsz + stco + stss)
+	mdhd = mp4_full_box("mdhd", 0, struct.pack(">IIIIHH", 0, 0, 12800, n * 512, 0, 0))
+	hdlr = mp4_full_box("hdlr", 0, b"\0" * 4 + b"vide" + b"\0" * 12 + b"v\0")
+	mdia = mp4_box("mdia", mdhd + hdlr + mp4_box("minf", stbl))
+	tkhd = mp4_full_box("tkhd", 0, struct.pack(">IIIII", 0, 0, track_id, 0, 0) + b"\0" * 60)
+	return mp4_box("trak", tkhd + mdia)
+
+def fixture_mp4(root:str, scale:float, rnd:random.Random) -> Tuple[int, int]:
+	"""
+	a progressive mp4 with a large sample table and a fragmented one with many moof+mdat pairs.
+	"""
+	ftyp = mp4_box("ftyp", b"isom\0\0\2\0isomavc1")
+	mvhd = mp4_full_box("mvhd", 0, struct.pack(">IIII", 0, 0, 1000, 0) + b"\0" * 80)
+	total = items = 0
+
+	n = max(1, int(200000 * scale))
+	samples_per_chunk = 10
+	sizes = [rnd.randint(32, 96) for _ in range(n)]
+	chunk_sizes = [sum(sizes[i:i + samples_per_chunk]) for i in range(0, n, samples_per_chunk)]
+	# moov first, its size does not depend on the offsets values
+	moov_size = len(mp4_box("moov", mvhd + mp4_trak(1, sizes, [0] * len(chunk_sizes), samples_per_chunk)))
+	offset = len(ftyp) + moov_size + 16
+	chunk_offsets = []
+	for size in chunk_sizes:
+		chunk_offsets.append(offset)
+		offset += size
+	moov = mp4_box("moov", mvhd + mp4_trak(1, sizes, chunk_offsets, samples_per_chunk))
+	mdat_size = sum(sizes)
+	path = os.path.join(root, "progressive.mp4")
+	with open(path, "wb") as f:
+		f.write(ftyp + moov + struct.pack(">I4sQ", 1, b"mdat", 16 + mdat_size))
+		block = bytes(range(256)) * 4096
+		for pos in range(0, mdat_size, len(block)):
+			f.write(block[:mdat_size - pos])
+	total += os.path.getsize(path)
+	items += n
+
+	fragments = max(1, int(4000 * scale))
+	samples_per_fragment = 60
+	trex = mp4_full_box("trex", 0, struct.pack(">IIIII", 1, 1, 512, 0, 0))
+	moov = mp4_box("moov", mvhd + mp4_trak(1, [], [], 1) + mp4_box("mvex", trex))
+	path = os.path.join(root, "fragmented.mp4")
+	with open(path, "wb") as f:
+		f.write(ftyp + moov)
+		for seq in range(fragments):
+			sizes = [rnd.randint(32, 96) for _ in range(samples_per_fragment)]
+			mfhd = mp4_full_box("mfhd", 0, struct.pack(">I", seq + 1))
+			tfhd = mp4_full_box("tfhd", 0, struct.pack(">I", 1), flags=0x020000)
+			tfdt = mp4_full_box("tfdt", 1, struct.pack(">Q", seq * samples_per_fragment * 512))
+			trun = mp4_full_box("trun", 0, struct.pack(">II%dI" % samples_per_fragment, samples_per_fragment, 0, *sizes), flags=0x000201)
+			f.write(mp4_box("moof", mfhd + mp4_box("traf", tfhd + tfdt + trun)))
+			f.write(mp4_box("mdat", b"\xaa" * sum(sizes)))
+	total += os.path.getsize(path)
+	items += fragments
+	return total, items
+
+def fixture_drivers(root:str, scale:float, rnd:random.Random) -> Tuple[int, int]:
+	"""
+	three DISM-style export directories of `<device>.<hash>` folders, each with an inf, a sys and a shared dll.
+	"""
+	devices = max(1, int(300 * scale))
+	encodings = ["utf-8", "utf-16", "utf-8-sig", "cp1252"]
+	languages = ["0409", "0804", "0407", "040c", "0411"]
+	total = items = 0
+	for batch in range(3):
+		batch_dir = os.path.join(root, "batch%d" % batch)
+		os.makedirs(batch_dir, exist_ok=True)
+		for device in range(devices):
+			# most devices are exported by every batch, in different versions
+			if rnd.random() < 0.2:
+				continue
+			name = "dev%04d" % device
+			driver_dir = os.path.join(batch_dir, "%s.%016x" % (name, rnd.getrandbits(64)))
+			os.makedirs(driver_dir)
+			version = "10.0.%d.%d" % (rnd.randint(1, 30), rnd.randint(0, 9999))
+			date = "%02d/%02d/%d" % (rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(2015, 2025))
+			hwids = ["PCI\\VEN_%04X&DEV_%04X" % (rnd.getrandbits(16), rnd.getrandbits(16)) for _ in range(rnd.randint(2, 40))]
+			lines = [
+				"; %s.inf" % name, "; Copyright (c) Example Corp; all rights reserved", "",
+				"[Version]", 'Signature="$WINDOWS NT$"', "Class=System", "Provider=%Mfg%",
+				"DriverVer=%s,%s" % (date, version), "CatalogFile=%s.cat" % name, "",
+				"[Manufacturer]", "%Mfg%=Models,NTamd64", "",
+				"[Models.NTamd64]",
+			]
+			lines += ["%%Desc%d%% = Install, %s" % (i % 4, hwid) for i, hwid in enumerate(hwids)]
+			lines += ["", "[Install.NT]", "CopyFiles=Driver.Files", "", "[Driver.Files]", "%s.sys" % name, "common.dll", ""]
+			lines += ["[Strings]", 'Mfg="Example ; Corp"'] + ['Desc%d="%s device %d = rev %d"' % (i, name, i, i) for i in range(4)]
+			for lang in rnd.sample(languages, rnd.randint(0, len(languages))):
+				lines += ["", "[Strings.%s]" % lang, 'Mfg="Example Corp %s"' % lang]
+				lines += ['Desc%d="%s %s %d"' % (i, name, lang, i) for i in range(4)]
+				lines += ['Msg%d="localized message %d, with \\"quotes\\" ; and = signs"' % (i, i) for i in range(rnd.randint(20, 200))]
+			inf_path = os.path.join(driver_dir, name + ".inf")
+			with open(inf_path, "w", encoding=rnd.choice(encodings), errors="replace", newline="\r\n") as f:
+				f.write("\n".join(lines) + "\n")
+			with open(os.path.join(driver_dir, name + ".sys"), "wb") as f:
+				f.write(rnd.randbytes(rnd.randint(4096, 65536)))
+			with open(os.path.join(driver_dir, "common.dll"), "wb") as f:
+				f.write(b"common" * 4096)
+			total += sum(entry.stat().st_size for entry in os.scandir(driver_dir))
+			items += 1
+	return total, items
+
+PY_STDLIB = ["os", "sys", "re", "json", "typing", "collections", "itertools", "functools", "pathlib", "datetime", "logging", "subprocess"]
+PY_THIRD = ["numpy", "requests", "yaml", "PIL", "pandas", "openpyxl", "chardet", "attr", "dateutil"]
+
+def fixture_python_repo(root:str, scale:float, rnd:random.Random) -> Tuple[int, int]:
+	"""
+	nested packages of modules mixing stdlib, third-party, relative, conditional and dynamic imports.
+	"""
+	modules = max(1, int(2000 * scale))
+	repo = os.path.join(root, "project")
+	packages = ["app"]
+	total = 0
+	for index in range(modules):
+		if index % 25 == 0:
+			package = rnd.choice(packages) + "/pkg%d" % (index // 25)
+			os.makedirs(os.path.join(repo, package), exist_ok=True)
+			with open(os.path.join(repo, package, "__init__.py"), "w", encoding="utf-8") as f:
+				f.write("from .mod%d import *\n" % index)
+			packages.append(package)
+		# some windows editors save with a BOM, the first line of these modules is an import
+		bom = index % 50 == 1
+		lines = [] if bom else ['"""', "module %d, `import fake` in a docstring is not an import." % index, '"""']
+		lines += ["import importlib"] + ["import %s" % name for name in rnd.sample(PY_STDLIB, 4)]
+		lines += ["from %s import %s" % (rnd.choice(PY_THIRD), "a, b") for _ in range(rnd.randint(0, 2))]
+		lines += ["from . import mod%d" % rnd.randrange(modules), "from .. import helpers"]
+		lines += ["try:", "\timport ujson as json", "except ImportError:", "\timport json", ""]
+		if index % 20 == 0:
+			# looks like a one-line compound import, the fast engine falls back to ast
+			lines += ["USAGE = 'usage: from app import mod'", ""]
+		lines += ["if typing.TYPE_CHECKING:", "\tfrom %s import Model" % rnd.choice(PY_THIRD), ""]
+		for fn in range(rnd.randint(5, 20)):
+			lines += [
+				"def func_%d(x, y=%d):" % (fn, fn),
+				'\t"""add x and y"""',
+				"\ttext = 'import %s' % x",
+			]
+			if fn % 5 == 0:
+				lines += ["\timport %s" % rnd.choice(PY_STDLIB), "\tmod = importlib.import_module('%s')" % rnd.choice(PY_THIRD)]
+			lines += ["\treturn [i * x + y for i in range(%d) if i %% 3]" % fn, ""]
+		path = os.path.join(repo, package, "mod%d.py" % index)
+		with open(path, "w", encoding="utf-8-sig" if bom else "utf-8") as f:
+			f.write("\n".join(lines))
+		total += os.path.getsize(path)
+	with open(os.path.join(repo, "requirements.txt"), "w", encoding="utf-8") as f:
+		f.write("\n".join(["numpy>=1.20", "requests", "PyYAML", "chardet"]) + "\n")
+	return total, modules
+
+XLSX_PARTS = {
+	"[Content_Types].xml": '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/><Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/><Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/></Types>',
+	"_rels/.rels": '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+	"xl/workbook.xml": '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+	"xl/_rels/workbook.xml.rels": '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/><Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/></Relationships>',
+	"xl/styles.xml": '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts><fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill><fill><patternFill patternType="solid"><fgColor rgb="FFFFFF00"/></patternFill></fill></fills><borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border><border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border></borders><cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs><cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf></cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>',
+}
+
+def xlsx_column(index:int) -> str:
+	name = ""
+	while index:
+		index, rem = divmod(index - 1, 26)
+		name = chr(65 + rem) + name
+	return name
+
+def fixture_workbook(root:str, scale:float, rnd:random.Random) -> Tuple[int, int]:
+	"""
+	a report-like sheet with a vertical merge every 4 rows and horizontal merges every 10 rows,
+	the xml is written directly as merging cells by openpyxl is too slow for big fixtures.
+	"""
+	rows = max(4, int(10000 * scale) // 4 * 4)
+	columns = [xlsx_column(i) for i in range(1, 13)]
+	merges = []
+	path = os.path.join(root, "merged.xlsx")
+	with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+		for name, xml in XLSX_PARTS.items():
+			zf.writestr(name, xml)
+		with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as f:
+			f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+			for row in range(1, rows + 1):
+				cells = []
+				if row % 4 == 1:
+					merges.append("A%d:A%d" % (row, row + 3))
+					cells.append('<c r="A%d" s="1" t="inlineStr"><is><t>group %d</t></is></c>' % (row, row // 4))
+				else:
+					cells.append('<c r="A%d" s="1"/>' % row)
+				horizontal = row % 10 == 0
+				if horizontal:
+					merges.append("B%d:D%d" % (row, row))
+				for col in columns[1:]:
+					if horizontal and col in ("C", "D"):
+						cells.append('<c r="%s%d" s="1"/>' % (col, row))
+					elif col in ("B", "E"):
+						cells.append('<c r="%s%d" t="inlineStr"><is><t>item %d</t></is></c>' % (col, row, rnd.randrange(100000)))
+					else:
+						cells.append('<c r="%s%d"><v>%d</v></c>' % (col, row, rnd.randrange(1000000)))
+				f.write(('<row r="%d">%s</row>' % (row, "".join(cells))).encode("utf-8"))
+			f.write(('</sheetData><mergeCells count="%d">%s</mergeCells></worksheet>' % (len(merges), "".join('<mergeCell ref="%s"/>' % ref for ref in merges))).encode("utf-8"))
+	return os.path.getsize(path), rows * len(columns)
+
+# province codes of GB/T 2260 used to build valid ID numbers
+ID_PROVINCES = [11, 12, 13, 14, 15, 21, 22, 23, 31, 32, 33, 34, 35, 36, 37, 41, 42, 43, 44, 45, 46, 50, 51, 52, 53, 54, 61, 62, 63, 64, 65]
+
+def fixture_ids(root:str, scale:float, rnd:random.Random) -> Tuple[int, int]:
+	"""
+	a csv of 500k ID numbers per scale, about 10% of them are invalid in different ways.
+	"""
+	count = max(1, int(500000 * scale))
+	weights = [2 ** (17 - i) % 11 for i in range(17)]
+	path = os.path.join(root, "ids.csv")
+	with open(path, "w", encoding="utf-8", newline="") as f:
+		f.write("name,id\n")
+		lines = []
+		for index in range(count):
+			birth = datetime.date(1940, 1, 1) + datetime.timedelta(days=rnd.randrange(30000))
+			body = "%02d%04d%s%03d" % (rnd.choice(ID_PROVINCES), rnd.randrange(10000), birth.strftime("%Y%m%d"), rnd.randrange(1000))
+			id_num = body + "10X98765432"[sum(int(d) * w for d, w in zip(body, weights)) % 11]
+			broken = rnd.random()
+			if broken < 0.04:
+				id_num = id_num[:17] + ("0" if id_num[17] != "0" else "1")
+			elif broken < 0.07:
+				id_num = "99" + id_num[2:]
+			elif broken < 0.09:
+				id_num = id_num[:10] + "13" + id_num[12:]
+			elif broken < 0.1:
+				id_num = id_num[:rnd.randint(10, 17)]
+			lines.append("person%d,%s\n" % (index, id_num))
+			if len(lines) >= 65536:
+				f.write("".join(lines))
+				lines.clear()
+		f.write("".join(lines))
+	return os.path.getsize(path), count
+
+FIXTURES:Dict[str, Callable] = {
+	"ndjson": fixture_ndjson,
+	"mp4": fixture_mp4,
+	"drivers": fixture_drivers,
+	"python_repo": fixture_python_repo,
+	"workbook": fixture_workbook,
+	"ids": fixture_ids,
+}
+
+# name: (fixture, command builder of (fixture dir, output dir))
+BENCHES:Dict[str, Tuple[str, Callable]] = {
+	"ndjson2csv_stream": ("ndjson", lambda src, out: ["ndjson2csv.py", os.path.join(src, "events.ndjson"), "--stream", "-o", os.path.join(out, "events.csv")]),
+	"ndjson2csv_jobs": ("ndjson", lambda src, out: ["ndjson2csv.py", os.path.join(src, "events.ndjson"), "-j", "4", "-o", os.path.join(out, "events.csv")]),
+	"mp4_samples": ("mp4", lambda src, out: ["parse_mp4_headers.py", os.path.join(src, "progressive.mp4"), os.path.join(src, "fragmented.mp4"), "-s"]),
+	"mp4_batch": ("mp4", lambda src, out: ["parse_mp4_headers.py", src, "-b", "-j", "1", "-o", os.path.join(out, "report.ndjson")]),
+	"win_driver_plan": ("drivers", lambda src, out: ["archive_win_driver.py", "-s"] + [os.path.join(src, "batch%d" % i) for i in range(3)] + ["--plan-out", os.path.join(out, "plan.json")]),
+	"packages_audit_fast": ("python_repo", lambda src, out: ["python_project_packages_audit.py", os.path.join(src, "project"), "--engine", "fast"]),
+	"packages_audit_ast": ("python_repo", lambda src, out: ["python_project_packages_audit.py", os.path.join(src, "project"), "--engine", "ast"]),
+	"excel_unmerge": ("workbook", lambda src, out: ["excel_auto_unmerge.py", os.path.join(src, "merged.xlsx"), "-o", os.path.join(out, "unmerged.xlsx"), "-s", "fill", "border"]),
+	"excel_unmerge_stream": ("workbook", lambda src, out: ["excel_auto_unmerge.py", os.path.join(src, "merged.xlsx"), "-o", os.path.join(out, "unmerged.xlsx"), "-s", "fill", "border", "--stream"]),
+	"chinese_id": ("ids", lambda src, out: ["check_chinese_id.py", os.path.join(src, "ids.csv"), "-c", "id", "-o", os.path.join(out, "failed.csv")]),
+}
+
+def prepare_fixture(fixtures_dir:str, name:str, scale:float, seed:int, regenerate:bool=False) -> Tuple[str, dict]:
+	"""
+	generate a fixture once per (name, scale, seed), the stamp file records its size and item count.
+	return (fixture dir, stamp)
+	"""
+	root = os.path.join(fixtures_dir, "%s-s%g-%d" % (name, scale, seed))
+	stamp_path = os.path.join(root, "fixture.json")
+	if not regenerate and os.path.isfile(stamp_path):
+		with open(stamp_path, "r", encoding="utf-8") as f:
+			stamp = json.load(f)
+		if stamp.get("version") == FIXTURE_VERSION:
+			return root, stamp
+	shutil.rmtree(root, ignore_errors=True)
+	os.makedirs(root)
+	start = time.perf_counter()
+	size, items = FIXTURES[name](root, scale, random.Random("%s-%d" % (name, seed)))
+	stamp = {"version": FIXTURE_VERSION, "bytes": size, "items": items}
+	with open(stamp_path, "w", encoding="utf-8") as f:
+		json.dump(stamp, f)
+	print("Generated fixture %s: %.1f MB, %d items in %.1fs." % (name, size / MB, items, time.perf_counter() - start), file=sys.stderr)
+	return root, stamp
+
+def run_measured(cmd:List[str], cwd:str=None) -> Tuple[int, float, float|None]:
+	"""
+	run a command with its output discarded.
+	return (exit code, wall seconds, peak RSS MB of the child), RSS is None where os.wait4 is not available.
+	"""
+	start = time.perf_counter()
+	proc = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+	if hasattr(os, "wait4"):
+		# the rusage of this child only, RUSAGE_CHILDREN is the max of every child ever waited
+		stderr = proc.stderr.read()
+		_, status, usage = os.wait4(proc.pid, 0)
+		wall = time.perf_counter() - start
+		proc.returncode = os.waitstatus_to_exitcode(status)
+		proc.stderr.close()
+		# ru_maxrss is in KB on linux and in bytes on macOS
+		rss = usage.ru_maxrss / (MB if sys.platform == "darwin" else 1024)
+	else:
+		_, stderr = proc.communicate()
+		wall = time.perf_counter() - start
+		rss = None
+	if proc.returncode:
+		sys.stderr.write(stderr.decode("utf-8", "replace")[-2000:])
+	return proc.returncode, wall, rss
+
+def run_bench(name:str, fixture_dir:str, stamp:dict, repeat:int=1) -> dict:
+	"""
+	run a bench REPEAT times and keep the fastest run.
+	"""
+	_, build = BENCHES[name]
+	best = None
+	for _ in range(repeat):
+		out_dir = tempfile.mkdtemp(prefix="bench-")
+		try:
+			cmd = build(fixture_dir, out_dir)
+			code, wall, rss = run_measured([sys.executable, os.path.join(SCRIPT_DIR, cmd[0])] + cmd[1:], cwd=out_dir)
+		finally:
+			shutil.rmtree(out_dir, ignore_errors=True)
+		if code:
+			return {"bench": name, "error": "exit code %d" % code}
+		if best is None or wall < best["wall_s"]:
+			best = {"bench": name, "wall_s": round(wall, 4), "peak_rss_mb": None if rss is None else round(rss, 1)}
+	best["mb_per_s"] = round(stamp["bytes"] / MB / best["wall_s"], 2)
+	best["items_per_s"] = round(stamp["items"] / best["wall_s"], 1)
+	return best
+
+def load_history(path:str) -> list:
+	if not os.path.isfile(path):
+		return []
+	with open(path, "r", encoding="utf-8") as f:
+		return json.load(f)
+
+def save_history(path:str, history:list):
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	tmp_path = path + ".tmp"
+	with open(tmp_path, "w", encoding="utf-8") as f:
+		json.dump(history, f, indent=1)
+	os.replace(tmp_path, path)
+
+def baseline(history:list, bench:str, scale:float, runs:int=5) -> dict|None:
+	"""
+	median wall time and peak RSS of the last RUNS successful results of a bench at the same scale.
+	"""
+	results = [result for run in history if run["scale"] == scale for result in run["results"] if result["bench"] == bench and "error" not in result][-runs:]
+	if not results:
+		return None
+	rss = [result["peak_rss_mb"] for result in results if result["peak_rss_mb"] is not None]
+	return {
+		"runs": len(results),
+		"wall_s": statistics.median(result["wall_s"] for result in results),
+		"peak_rss_mb": statistics.median(rss) if rss else None,
+	}
+
+def check_regressions(result:dict, base:dict|None, threshold:float) -> List[str]:
+	"""
+	metrics of the result which exceed the baseline by more than threshold, as a ratio.
+	"""
+	if base is None or "error" in result:
+		return []
+	regressions = []
+	for metric in ("wall_s", "peak_rss_mb"):
+		if result[metric] is not None and base[metric] is not None and result[metric] > base[metric] * (1 + threshold):
+			regressions.append("%s %+.0f%%" % (metric, (result[metric] / base[metric] - 1) * 100))
+	return regressions
+
+def git_commit() -> str|None:
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def format_delta(value:float|None, base:float|None) -> str:
+	if value is None or base is None:
+		return "-"
+	return "%+.1f%%" % ((value / base - 1) * 100)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the tools on generated fixtures, record the results and fail on regressions.")
+	parser.add_argument("-b", "--bench", action="extend", nargs="+", choices=list(BENCHES), default=None, help="Benches to run, default all.")
+	parser.add_argument("--scale", type=float, default=1.0, help="Fixture size factor, 1 is about 64MB of NDJSON, use 32 or more for multi-GB runs.")
+	parser.add_argument("--seed", type=int, default=0, help="Random seed of the fixture generators.")
+	parser.add_argument("--fixtures", type=str, default=os.path.join(tempfile.gettempdir(), "benchmark_tools_fixtures"), help="Folder where fixtures are generated once and reused.")
+	parser.add_argument("--regenerate", action="store_true", help="Generate the fixtures again even if they exist.")
+	parser.add_argument("-r", "--repeat", type=int, default=1, help="Run every bench REPEAT times and keep the fastest.")
+	parser.add_argument("--history", type=str, default=os.path.join(os.path.expanduser("~"), ".cache", "benchmark_tools.history.json"), help="Json file of the results of every run.")
+	parser.add_argument("-t", "--threshold", type=float, default=0.2, help="Fail if wall time or peak RSS exceeds the baseline by more than this ratio.")
+	parser.add_argument("--baseline-runs", type=int, default=5, help="The baseline is the median of the last so many results at the same scale.")
+	parser.add_argument("--no-save", action="store_true", help="Compare against the history without recording this run.")
+	args = parser.parse_args()
+
+	# benches run in their output folders, fixture paths must not be relative
+	args.fixtures = os.path.abspath(args.fixtures)
+	benches = args.bench or list(BENCHES)
+	history = load_history(args.history)
+	results = []
+	failed = False
+	print("%-22s %9s %9s %9s %11s %8s %8s  %s" % ("bench", "wall(s)", "rss(MB)", "MB/s", "items/s", "Δwall", "Δrss", "status"))
+	for name in benches:
+		fixture_dir, stamp = prepare_fixture(args.fixtures, BENCHES[name][0], args.scale, args.seed, args.regenerate)
+		result = run_bench(name, fixture_dir, stamp, args.repeat)
+		results.append(result)
+		if "error" in result:
+			failed = True
+			print("%-22s %s" % (name, result["error"]))
+			continue
+		base = baseline(history, name, args.scale, args.baseline_runs)
+		regressions = check_regressions(result, base, args.threshold)
+		failed = failed or bool(regressions)
+		status = "REGRESSED " + ", ".join(regressions) if regressions else ("ok" if base else "no baseline")
+		print("%-22s %9.3f %9s %9.1f %11.0f %8s %8s  %s" % (
+			name, result["wall_s"], "-" if result["peak_rss_mb"] is None else "%.1f" % result["peak_rss_mb"],
+			result["mb_per_s"], result["items_per_s"],
+			format_delta(result["wall_s"], base and base["wall_s"]), format_delta(result["peak_rss_mb"], base and base["peak_rss_mb"]), status))
+
+	if not args.no_save:
+		history.append({
+			"time": datetime.datetime.now().isoformat(timespec="seconds"),
+			"commit": git_commit(),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"scale": args.scale,
+			"seed": args.seed,
+			"results": results,
+		})
+		save_history(args.history, history)
+	sys.exit(1 if failed else 0)
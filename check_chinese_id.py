@@ -1,12 +1,212 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# weight of the i-th digit is 2 ** (17 - i) % 11
+WEIGHTS = tuple(2 ** (17 - i) % 11 for i in range(17))
+# check char indexed by the weighted sum % 11
+CHECK_CHARS = "10X98765432"
+# province level region codes of GB/T 2260, 71 Taiwan, 81 Hong Kong, 82 Macau, 83 Taiwan residents permit
+PROVINCE_CODES = frozenset([11, 12, 13, 14, 15, 21, 22, 23, 31, 32, 33, 34, 35, 36, 37, 41, 42, 43, 44, 45, 46, 50, 51, 52, 53, 54, 61, 62, 63, 64, 65, 71, 81, 82, 83])
+MIN_BIRTH_YEAR = 1800
+CHUNK_SIZE = 1 << 16
+DIGITS = frozenset("0123456789")
+REASON_BITS = ("region", "birth_date", "checksum")
+# joined reasons of every combination of the failed REASON_BITS
+REASON_TABLE = [";".join(name for bit, name in enumerate(REASON_BITS) if code >> bit & 1) or None for code in range(1 << len(REASON_BITS))]
+
+def validate_china_id(id_num:str, regions:set=None, today:int=None) -> list:
+	"""
+	Validate a Chinese ID card number.
+	Args:
+		regions: valid 6 digits region codes, only the province is checked if None.
+		today: yyyymmdd int, birth dates after it are invalid, default today.
+	Returns:
+		list: failed reasons of "length", "format", "region", "birth_date", "checksum", empty if valid.
+	"""
+	if len(id_num) != 18:
+		return ["length"]
+	if not DIGITS.issuperset(id_num[:17]) or (id_num[17] not in DIGITS and id_num[17] != "X"):
+		return ["format"]
+	reasons = []
+	if int(id_num[:2]) not in PROVINCE_CODES or (regions is not None and int(id_num[:6]) not in regions):
+		reasons.append("region")
+	today = today or int(datetime.date.today().strftime("%Y%m%d"))
+	birth = int(id_num[6:14])
+	try:
+		datetime.date(birth // 10000, birth // 100 % 100, birth % 100)
+		valid_birth = MIN_BIRTH_YEAR * 10000 < birth <= today
+	except ValueError:
+		valid_birth = False
+	if not valid_birth:
+		reasons.append("birth_date")
+	S = sum(int(d) * w for d, w in zip(id_num, WEIGHTS))
+	if CHECK_CHARS[S % 11] != id_num[17]:
+		reasons.append("checksum")
+	return reasons
+
 def check_china_id(id_num:str) -> bool:
-	assert len(id_num) == 18
-	S = 0
-	for i in range(17):
-		S += int(id_num[i]) * 2 ** (17 - i) % 11
-	checksum = (12 - (S % 11)) % 11
-	checkchar = str(checksum) if checksum < 10 else 'X'
-	return checkchar == id_num[17]
-
-id_num = input('Please input Chinese ID card number:')
-res = check_china_id(id_num)
-print('Checksum correct.' if res else 'Checksum invalid.')
+	"""
+	Whether the length, format and checksum of the ID number are valid.
+	"""
+	return not [reason for reason in validate_china_id(id_num) if reason not in ("region", "birth_date")]
+
+def validate_china_ids_numpy(ids:list, regions:set=None, today:int=None) -> list:
+	"""
+	validate_china_ids on a uint8 digit matrix of the well formed ASCII IDs.
+	"""
+	today = today or int(datetime.date.today().strftime("%Y%m%d"))
+	reasons = [None] * len(ids)
+	rows = [idx for idx, id_num in enumerate(ids) if len(id_num) == 18 and id_num.isascii()]
+	if len(rows) < len(ids):
+		for idx in set(range(len(ids))).difference(rows):
+			reasons[idx] = "length" if len(ids[idx]) != 18 else "format"
+	if not rows:
+		return reasons
+
+	matrix = numpy.frombuffer("".join([ids[idx] for idx in rows]).encode("ascii"), dtype=numpy.uint8).reshape(-1, 18)
+	digits = matrix[:, :17] - numpy.uint8(48)
+	last = matrix[:, 17]
+	valid_format = (digits <= 9).all(axis=1) & (((last >= 48) & (last <= 57)) | (last == ord("X")))
+	digits = digits.astype(numpy.int64)
+
+	province_mask = numpy.zeros(100, dtype=bool)
+	province_mask[list(PROVINCE_CODES)] = True
+	valid_region = province_mask[(digits[:, 0] * 10 + digits[:, 1]) % 100]
+	if regions is not None:
+		codes = digits[:, :6] @ numpy.array([100000, 10000, 1000, 100, 10, 1])
+		valid_region &= numpy.isin(codes, numpy.fromiter(regions, dtype=numpy.int64, count=len(regions)))
+
+	year = digits[:, 6:10] @ numpy.array([1000, 100, 10, 1])
+	month = digits[:, 10] * 10 + digits[:, 11]
+	day = digits[:, 12] * 10 + digits[:, 13]
+	leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+	month_days = numpy.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[numpy.clip(month, 0, 12)] + (leap & (month == 2))
+	birth = year * 10000 + month * 100 + day
+	valid_birth = (month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days) & (birth > MIN_BIRTH_YEAR * 10000) & (birth <= today)
+
+	expected = numpy.frombuffer(CHECK_CHARS.encode("ascii"), dtype=numpy.uint8)[(digits @ numpy.array(WEIGHTS)) % 11]
+	valid_checksum = expected == last
+
+	codes = (~valid_region).astype(numpy.uint8) | (~valid_birth).astype(numpy.uint8) << 1 | (~valid_checksum).astype(numpy.uint8) << 2
+	failed = numpy.flatnonzero(~valid_format | (codes != 0))
+	for row, code, well_formed in zip(failed.tolist(), codes[failed].tolist(), valid_format[failed].tolist()):
+		reasons[rows[row]] = REASON_TABLE[code] if well_formed else "format"
+	return reasons
+
+def validate_china_ids(ids:list, regions:set=None, today:int=None) -> list:
+	"""
+	Validate a batch of ID numbers, vectorized by numpy if installed.
+	Returns:
+		list: failed reasons joined by ";" of every ID, None if valid.
+	"""
+	if numpy is not None:
+		return validate_china_ids_numpy(ids, regions, today)
+	today = today or int(datetime.date.today().strftime("%Y%m%d"))
+	return [";".join(reasons) or None for reasons in (validate_china_id(id_num, regions, today) for id_num in ids)]
+
+def load_regions(path:str) -> set:
+	"""
+	6 digits region codes from the first column of a text or csv file.
+	"""
+	regions = set()
+	with open(path, 'r', encoding='utf-8-sig') as f:
+		for line in f:
+			code = line.split(",", 1)[0].strip()
+			if len(code) == 6 and code.isdigit():
+				regions.add(int(code))
+	return regions
+
+def iter_ids(f, fmt:str, column:str=None, header:bool=True):
+	"""
+	Yield (line number, ID number) from a csv, ndjson or plain text stream, one ID per line for text.
+	For csv, column is a header name or a 0-based index, default the first column.
+	The first csv row is the header unless header is False, then column must be an index.
+	"""
+	if fmt == "csv":
+		reader = csv.reader(f)
+		index = 0
+		names = next(reader, []) if header else None
+		if column is not None and column.isdigit():
+			index = int(column)
+		elif column is not None:
+			if names is None:
+				raise ValueError("column %r must be an index for csv without header." % column)
+			index = names.index(column)
+		for row in reader:
+			yield reader.line_num, row[index].strip() if index < len(row) else ""
+	elif fmt == "ndjson":
+		for line_no, line in enumerate(f, start=1):
+			if line.strip():
+				value = json.loads(line).get(column or "id")
+				yield line_no, "" if value is None else str(value).strip()
+	else:
+		for line_no, line in enumerate(f, start=1):
+			yield line_no, line.strip()
+
+def validate_stream(f, fmt:str, column:str=None, regions:set=None, chunk_size:int=CHUNK_SIZE, header:bool=True):
+	"""
+	Validate the IDs of a stream in chunks.
+	Yields:
+		tuple: (line number, ID number, reasons or None) of every row.
+	"""
+	today = int(datetime.date.today().strftime("%Y%m%d"))
+	rows = iter_ids(f, fmt, column, header)
+	while True:
+		chunk = [row for _, row in zip(range(chunk_size), rows)]
+		if not chunk:
+			return
+		for (line_no, id_num), reasons in zip(chunk, validate_china_ids([id_num for _, id_num in chunk], regions, today)):
+			yield line_no, id_num, reasons
+
+def detect_format(path:str) -> str:
+	ext = os.path.splitext(path)[1].lower()
+	return {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(ext, "txt")
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Validate Chinese ID card numbers, interactively or in bulk from a file.")
+	parser.add_argument("FILE", type=str, nargs="?", default=None, help="csv, ndjson or text file of ID numbers, - for stdin, prompt for one number if omitted.")
+	parser.add_argument("-c", "--column", type=str, default=None, help="Column name or 0-based index for csv, key for ndjson (default id).")
+	parser.add_argument("-f", "--format", choices=["csv", "ndjson", "txt"], default=None, help="Input format, detected by the file extension by default.")
+	parser.add_argument("-o", "--output", type=str, default="-", help="Csv of the failed rows with their reasons, - for stdout.")
+	parser.add_argument("--no-header", action="store_true", help="The csv has no header row, --column must be an index.")
+	parser.add_argument("-a", "--all", action="store_true", help="Write every row, with empty reasons for valid IDs.")
+	parser.add_argument("-r", "--regions", type=str, default=None, help="File of valid 6 digits region codes, only provinces are checked by default.")
+	args = parser.parse_args()
+
+	if args.no_header and args.column is not None and not args.column.isdigit():
+		parser.error("--column must be an index with --no-header.")
+	regions = load_regions(args.regions) if args.regions else None
+	if args.FILE is None:
+		id_num = input('Please input Chinese ID card number:')
+		reasons = validate_china_id(id_num.strip(), regions)
+		print('Checksum correct.' if check_china_id(id_num.strip()) else 'Checksum invalid.')
+		if reasons:
+			print('Invalid:', ", ".join(reasons))
+		sys.exit(0)
+
+	fmt = args.format or detect_format(args.FILE)
+	fin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='') if args.FILE == "-" else open(args.FILE, 'r', encoding='utf-8-sig', newline='')
+	fout = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8', newline='')
+	total = 0
+	counts = {}
+	with fin, fout:
+		writer = csv.writer(fout)
+		writer.writerow(["line", "id", "reasons"])
+		for line_no, id_num, reasons in validate_stream(fin, fmt, args.column, regions, header=not args.no_header):
+			total += 1
+			if reasons is not None:
+				for reason in reasons.split(";"):
+					counts[reason] = counts.get(reason, 0) + 1
+			if reasons is not None or args.all:
+				writer.writerow([line_no, id_num, reasons or ""])
+	sys.stderr.write("%d rows, %s\n" % (total, ", ".join("%s %d" % item for item in sorted(counts.items())) or "all valid"))
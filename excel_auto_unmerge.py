@@ -1,14 +1,41 @@
 import argparse
+import concurrent.futures
 import copy
+import os
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+import zipfile
 
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.utils.cell import range_boundaries
+
+STYLE_NAMES = ("font", "fill", "border", "alignment", "number_format", "protection")
+# cell attribute -> index field of the shared style tables in StyleArray
+STYLE_IDS = {"font": "fontId", "fill": "fillId", "border": "borderId", "alignment": "alignmentId", "number_format": "numFmtId", "protection": "protectionId"}
+WORKBOOK_EXTS = (".xlsx", ".xlsm")
+MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([A-Za-z0-9$:]+)"')
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
 
 def get_base_state(cell, inherit:list=["value"]) -> dict:
-	return {name: copy.copy(getattr(cell, name)) for name in inherit}
+	"""
+	Styles are kept as ids of the workbook style tables, so all inheriting cells share one style object.
+	"""
+	style = cell._style or StyleArray()
+	return {name: getattr(style, STYLE_IDS[name]) if name in STYLE_IDS else copy.copy(getattr(cell, name)) for name in inherit}
 
 def assign_state(cell, res:dict):
 	for name, state in res.items():
-		setattr(cell, name, state)
+		if name in STYLE_IDS:
+			if not cell._style:
+				cell._style = StyleArray()
+			setattr(cell._style, STYLE_IDS[name], state)
+		else:
+			setattr(cell, name, state)
 
 def auto_unmerge_sheet(sheet, inherit:list=["value"]):
 	merged_cells = list(sheet.merged_cells)
@@ -30,13 +57,231 @@ def auto_unmerge_workbook(workbook, inherit:list=["value"]):
 	for sheet in workbook:
 		auto_unmerge_sheet(sheet, inherit)
 
+def sheet_paths(archive:zipfile.ZipFile) -> dict:
+	"""
+	Map sheet title -> worksheet xml path in the xlsx archive.
+	"""
+	workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+	rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+	targets = {}
+	for rel in rels.iter(PKG_REL_NS + "Relationship"):
+		target = rel.get("Target")
+		targets[rel.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+	return {sheet.get("name"): targets.get(sheet.get(REL_NS + "id")) for sheet in workbook.iter(MAIN_NS + "sheet")}
+
+def scan_merged_ranges(stream, block_size:int=1<<20) -> list:
+	"""
+	Find the mergeCell refs in a worksheet xml stream by a byte search, without parsing the xml.
+	Returns:
+		list: (left, top, right, bottom) of each merged range.
+	"""
+	ranges = []
+	tail = b""
+	while True:
+		block = stream.read(block_size)
+		buf = tail + block
+		# matches close to the end may be cut, search them again with the next block
+		limit = len(buf) if not block else max(len(buf) - 256, 0)
+		for m in MERGE_CELL_RE.finditer(buf):
+			if m.start() >= limit:
+				break
+			ranges.append(range_boundaries(m.group(1).decode("ascii").replace("$", "")))
+		if not block:
+			return ranges
+		tail = buf[limit:]
+
+def read_merged_ranges(xlsx_path:str) -> dict:
+	"""
+	Map sheet title -> merged ranges, read from the sheet xml before the sheet is streamed.
+	"""
+	with zipfile.ZipFile(xlsx_path) as archive:
+		merged = {}
+		for title, path in sheet_paths(archive).items():
+			if path is None or path not in archive.NameToInfo:
+				continue
+			with archive.open(path) as stream:
+				merged[title] = scan_merged_ranges(stream)
+		return merged
+
+class StreamStyles:
+	"""
+	Copy cell styles from a read-only sheet to write-only cells.
+	Every distinct (own style, inherited style) pair is resolved once, later cells reuse its style array.
+	"""
+	def __init__(self, inherit:list):
+		self.inherit = [name for name in inherit if name in STYLE_NAMES]
+		self.arrays = {}
+
+	@staticmethod
+	def style_key(cell) -> tuple:
+		return tuple(cell.style_array) if getattr(cell, "has_style", False) else None
+
+	def apply(self, target, source, base=None):
+		key = (self.style_key(source), self.style_key(base) if self.inherit else None)
+		array = self.arrays.get(key)
+		if array is not None:
+			target._style = copy.copy(array)
+			return
+		if key[0] is not None:
+			for name in STYLE_NAMES:
+				setattr(target, name, getattr(source, name))
+		if key[1] is not None:
+			for name in self.inherit:
+				setattr(target, name, getattr(base, name))
+		self.arrays[key] = copy.copy(target._style)
+
+def stream_unmerge_sheet(source, target, merged_ranges:list, inherit:list=["value"]):
+	"""
+	Copy the rows of a read-only sheet to a write-only sheet, filling every merged range from its top-left cell.
+	The merged ranges are swept by their top row, so only the ranges crossing the current row are kept.
+	"""
+	pending = sorted(merged_ranges, key=lambda bounds: bounds[1])
+	styles = StreamStyles(inherit)
+	inherit_value = "value" in inherit or "data_type" in inherit
+	next_range = 0
+	active = []
+	for row_idx, row in enumerate(source.iter_rows(), start=1):
+		if active and any(bounds[3] < row_idx for bounds, _ in active):
+			active = [item for item in active if item[0][3] >= row_idx]
+		while next_range < len(pending) and pending[next_range][1] <= row_idx:
+			bounds = pending[next_range]
+			next_range += 1
+			if bounds[3] >= row_idx and (bounds[0], bounds[1]) != (bounds[2], bounds[3]):
+				active.append((bounds, row[bounds[0]-1] if bounds[1] == row_idx and bounds[0] <= len(row) else None))
+		if not active:
+			values = []
+			for cell in row:
+				if getattr(cell, "has_style", False):
+					out = WriteOnlyCell(target, cell.value)
+					styles.apply(out, cell)
+					values.append(out)
+				else:
+					values.append(cell.value)
+			target.append(values)
+			continue
+
+		covered = {}
+		for bounds, base in active:
+			left, top, right, bottom = bounds
+			for col in range(left, right+1):
+				if row_idx != top or col != left:
+					covered[col] = base
+		values = []
+		for col in range(1, max(len(row), max(covered, default=0)) + 1):
+			cell = row[col-1] if col <= len(row) else None
+			value = cell.value if cell is not None else None
+			if col in covered:
+				base = covered[col]
+				if inherit_value:
+					value = base.value if base is not None else None
+				out = WriteOnlyCell(target, value)
+				styles.apply(out, cell, base)
+				values.append(out)
+			elif getattr(cell, "has_style", False):
+				out = WriteOnlyCell(target, value)
+				styles.apply(out, cell)
+				values.append(out)
+			else:
+				values.append(value)
+		target.append(values)
+
+def stream_unmerge_workbook(src_path:str, dst_path:str, inherit:list=["value"]):
+	"""
+	Unmerge a workbook through a read-only reader and a write-only writer, memory is bounded by the row width.
+	Only cell values and styles are copied, sheet settings such as column widths are dropped.
+	"""
+	merged = read_merged_ranges(src_path)
+	source = openpyxl.load_workbook(src_path, read_only=True)
+	workbook = openpyxl.Workbook(write_only=True)
+	try:
+		for sheet in source.worksheets:
+			target = workbook.create_sheet(sheet.title)
+			stream_unmerge_sheet(sheet, target, merged.get(sheet.title, []), inherit)
+		workbook.save(dst_path)
+	finally:
+		source.close()
+
+def unmerge_file(src_path:str, dst_path:str, inherit:list=["value"], stream:bool=False):
+	if stream:
+		stream_unmerge_workbook(src_path, dst_path, inherit=inherit)
+	else:
+		workbook = openpyxl.load_workbook(src_path)
+		auto_unmerge_workbook(workbook, inherit=inherit)
+		workbook.save(dst_path)
+
+def unmerge_task(task:tuple) -> str:
+	"""
+	Unmerge one workbook without raising, for worker processes.
+	Returns:
+		str: error message, None if succeeded.
+	"""
+	src_path, dst_path, inherit, stream = task
+	try:
+		os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+		unmerge_file(src_path, dst_path, inherit, stream)
+	except Exception as e:
+		return "%s: %s" % (type(e).__name__, e)
+	return None
+
+def iter_workbooks(paths:list):
+	"""
+	Yield (workbook path, path relative to its root) of the files, and of the workbooks under the folders.
+	"""
+	for path in paths:
+		if not os.path.isdir(path):
+			yield path, os.path.basename(path)
+			continue
+		for root, dirs, files in os.walk(path):
+			dirs.sort()
+			for fn in sorted(files):
+				if fn.lower().endswith(WORKBOOK_EXTS) and not fn.startswith("~$"):
+					file_path = os.path.join(root, fn)
+					yield file_path, os.path.relpath(file_path, path)
+
+def batch_unmerge(paths:list, output_dir:str, inherit:list=["value"], stream:bool=False, jobs:int=1) -> list:
+	"""
+	Unmerge many workbooks into output_dir in a process pool, keeping their relative paths.
+	Explicit files are written by their names, colliding names are made unique with a suffix.
+	Workbooks are the unit of work, as the sheets of a workbook share its style tables.
+	Returns:
+		list: (source path, output path, error message or None) in input order.
+	"""
+	tasks = []
+	taken = set()
+	for src_path, rel_path in iter_workbooks(paths):
+		# same named inputs from different places get a _2, _3... suffix instead of overwriting each other
+		dst_path = os.path.join(output_dir, rel_path)
+		stem, ext = os.path.splitext(dst_path)
+		count = 1
+		while dst_path.lower() in taken:
+			count += 1
+			dst_path = "%s_%d%s" % (stem, count, ext)
+		taken.add(dst_path.lower())
+		tasks.append((src_path, dst_path, inherit, stream))
+	if jobs > 1 and len(tasks) > 1:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+			errors = list(executor.map(unmerge_task, tasks))
+	else:
+		errors = [unmerge_task(task) for task in tasks]
+	return [(task[0], task[1], error) for task, error in zip(tasks, errors)]
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Auto unmerge all the merged cells in xlsx file with specific style retain.")
-	parser.add_argument("FILE", type=str, help="Excel file to unmerge.")
-	parser.add_argument("-o", "--output", default="unmerged.xlsx", type=str, help="Where to save the unmerged result.")
+	parser.add_argument("FILE", type=str, nargs="+", help="Excel file to unmerge, several files or folders to unmerge in batch.")
+	parser.add_argument("-o", "--output", default=None, type=str, help="Where to save the unmerged result, default unmerged.xlsx, the output folder in batch, default unmerged.")
 	parser.add_argument("-s", "--inherit-state", action="extend", nargs="+", default=["value"], choices=["value", "alignment", "border", "data_type", "fill", "font"], help="Which style retain, default is value.")
+	parser.add_argument("--stream", action="store_true", help="Stream rows with read-only and write-only workbooks for large files, only cell values and styles are kept.")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Unmerge JOBS workbooks in parallel in batch.")
 	args = parser.parse_args()
 
-	workbook = openpyxl.load_workbook(args.FILE)
-	auto_unmerge_workbook(workbook, inherit=args.inherit_state)
-	workbook.save(args.output)
+	if len(args.FILE) == 1 and not os.path.isdir(args.FILE[0]):
+		unmerge_file(args.FILE[0], args.output or "unmerged.xlsx", inherit=args.inherit_state, stream=args.stream)
+	else:
+		args.output = args.output or "unmerged"
+		results = batch_unmerge(args.FILE, args.output, inherit=args.inherit_state, stream=args.stream, jobs=args.jobs)
+		failed = [(src_path, error) for src_path, _, error in results if error]
+		for src_path, error in failed:
+			print("Failed on %s: %s" % (src_path, error))
+		print("Unmerged %d of %d workbooks into %s" % (len(results) - len(failed), len(results), args.output))
+		if failed:
+			exit(1)
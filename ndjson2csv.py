@@ -1,7 +1,25 @@
 import argparse
+import bz2
+import concurrent.futures
 import csv
+import gzip
+import io
+import itertools
 import json
+import lzma
+import os
+import queue
 import sys
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+BUFFER_SIZE = 1024 * 1024
+COMPRESSION_MAGIC = {
+	"gz": b"\x1f\x8b",
+	"bz2": b"BZh",
+	"xz": b"\xfd7zXZ\x00",
+	"zst": b"\x28\xb5\x2f\xfd",
+}
 
 def read_ndjson(ndjson_file:open) -> dict:
 	lines = ndjson_file.readlines()
@@ -10,6 +28,93 @@ def read_ndjson(ndjson_file:open) -> dict:
 	return data
 # read multi-line json data
 
+def flatten(item:dict, sep:str='.', prefix:str='') -> dict:
+	"""
+	flatten nested objects as dotted keys, {"a": {"b": 1}} --> {"a.b": 1}.
+	arrays and empty objects are kept as json strings.
+	"""
+	res = {}
+	for key, value in item.items():
+		name = prefix + key
+		if isinstance(value, dict) and value:
+			res.update(flatten(value, sep, name + sep))
+		elif isinstance(value, (dict, list)):
+			res[name] = json.dumps(value, ensure_ascii=False)
+		else:
+			res[name] = value
+	return res
+
+def iter_ndjson(ndjson_file:open, flat:bool=False) -> Iterator[dict]:
+	for line in ndjson_file:
+		line = line.strip()
+		if line:
+			yield flatten(json.loads(line)) if flat else json.loads(line)
+# yield json data line by line, blank lines are skipped
+
+def union_keys(records:Iterable[dict]) -> List[str]:
+	tab_head = {}
+	for item in records:
+		tab_head.update(dict.fromkeys(item))
+	return list(tab_head)
+# combine keys as table titles in first-seen order
+
+def scan_header(ndjson_file:open, sample:int|None=None, flat:bool=False) -> List[str]:
+	"""
+	collect the union of keys as table titles in first-seen order.
+	only the first `sample` records are scanned if sample is given.
+	"""
+	return union_keys(itertools.islice(iter_ndjson(ndjson_file, flat), sample))
+
+def value_type(value:Any) -> str:
+	if value is None:
+		return "null"
+	if isinstance(value, bool):
+		return "bool"
+	if isinstance(value, int):
+		return "int" if -2**63 <= value < 2**63 else "string"
+	if isinstance(value, float):
+		return "float"
+	return "string"
+
+def merge_type(a:str, b:str) -> str:
+	if a == b or b == "null":
+		return a
+	if a == "null":
+		return b
+	if {a, b} == {"int", "float"}:
+		return "float"
+	return "string"
+# null < bool/int < float < string, bool mixed with numbers falls back to string
+
+def infer_types(records:Iterable[dict]) -> Dict[str, str]:
+	"""
+	infer column types of flattened records incrementally.
+	return {title: "null"|"bool"|"int"|"float"|"string"} in first-seen order.
+	"""
+	types = {}
+	for item in records:
+		for key, value in item.items():
+			types[key] = merge_type(types.get(key, "null"), value_type(value))
+	return types
+
+def scan_types(ndjson_file:open, sample:int|None=None) -> Dict[str, str]:
+	return infer_types(itertools.islice(iter_ndjson(ndjson_file, flat=True), sample))
+
+def rewind(ndjson_file:open):
+	if not ndjson_file.seekable():
+		raise ValueError("scanning titles needs a seekable input, give a schema or a sample when reading from a pipe.")
+	ndjson_file.seek(0)
+
+def read_schema(schema_file:open) -> List[str]:
+	"""
+	read table titles from a json array or a text file with one title per line.
+	"""
+	context = schema_file.read()
+	schema_file.close()
+	if context.lstrip().startswith("["):
+		return [str(name) for name in json.loads(context)]
+	return [line.strip() for line in context.splitlines() if line.strip()]
+
 def write_csv(csv_file:str, data:dict):
 	tab_head = set()
 	for item in data:
@@ -23,16 +128,408 @@ def write_csv(csv_file:str, data:dict):
 	csv_file.close()
 # write dict data to the csv file
 
-def ndjson_to_csv(ndjson_file:open, csv_file) -> dict:
+def stream_csv(ndjson_file:open, csv_file, fieldnames:List[str]|None=None, sample:int|None=None, flat:bool=False):
+	"""
+	two-pass convert which keeps only one record in memory.
+	the first pass collects table titles, it is skipped if fieldnames is given.
+	sampled records are kept and replayed, so a sample works on pipes too.
+	keys out of the titles are dropped when titles come from a schema or a sample.
+	"""
+	extrasaction = "ignore" if fieldnames is not None or sample is not None else "raise"
+	if fieldnames is None and sample is None:
+		fieldnames = scan_header(ndjson_file, flat=flat)
+		rewind(ndjson_file)
+	records = iter_ndjson(ndjson_file, flat)
+	if fieldnames is None:
+		head = list(itertools.islice(records, sample))
+		fieldnames = union_keys(head)
+		records = itertools.chain(head, records)
+
+	writer = csv.DictWriter(csv_file, fieldnames=fieldnames, extrasaction=extrasaction)
+	writer.writeheader()
+	for item in records:
+		writer.writerow(item)
+	ndjson_file.close()
+	csv_file.close()
+
+def split_chunks(ndjson_path:str, chunk_size:int) -> List[Tuple[int, int]]:
+	"""
+	split the file into [start, end) byte ranges, every range ends at a newline.
+	"""
+	chunks = []
+	file_size = os.path.getsize(ndjson_path)
+	with open(ndjson_path, 'rb') as f:
+		start = 0
+		while start < file_size:
+			f.seek(min(start + chunk_size, file_size))
+			f.readline()
+			end = min(f.tell(), file_size)
+			chunks.append((start, end))
+			start = end
+	return chunks
+
+def iter_chunk(ndjson_path:str, start:int, end:int, flat:bool=False) -> Iterator[dict]:
+	with open(ndjson_path, 'rb') as f:
+		f.seek(start)
+		data = f.read(end - start)
+	yield from iter_ndjson(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8'), flat)
+
+def chunk_header(ndjson_path:str, start:int, end:int, flat:bool=False) -> List[str]:
+	return union_keys(iter_chunk(ndjson_path, start, end, flat))
+
+def chunk_csv(ndjson_path:str, start:int, end:int, fieldnames:List[str], extrasaction:str, flat:bool=False) -> str:
+	buffer = io.StringIO()
+	writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction=extrasaction)
+	for item in iter_chunk(ndjson_path, start, end, flat):
+		writer.writerow(item)
+	return buffer.getvalue()
+
+def map_ordered(executor, fn, tasks:list, window:int) -> Iterator:
+	"""
+	like executor.map, but only `window` tasks are in flight to bound memory.
+	"""
+	futures = []
+	for task in tasks:
+		futures.append(executor.submit(fn, *task))
+		if len(futures) >= window:
+			yield futures.pop(0).result()
+	for future in futures:
+		yield future.result()
+
+def parallel_csv(ndjson_path:str, csv_file, jobs:int, fieldnames:List[str]|None=None, flat:bool=False, chunk_size:int=64*1024*1024):
+	"""
+	two-pass convert with a process pool, every pass works on newline aligned chunks.
+	chunk titles are merged in file order so the output equals a serial stream_csv.
+	"""
+	extrasaction = "ignore" if fieldnames is not None else "raise"
+	chunks = split_chunks(ndjson_path, chunk_size)
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+		if fieldnames is None:
+			tab_head = {}
+			for keys in map_ordered(executor, chunk_header, [(ndjson_path, *c, flat) for c in chunks], jobs*2):
+				tab_head.update(dict.fromkeys(keys))
+			fieldnames = list(tab_head)
+
+		writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+		writer.writeheader()
+		for fragment in map_ordered(executor, chunk_csv, [(ndjson_path, *c, fieldnames, extrasaction, flat) for c in chunks], jobs*2):
+			csv_file.write(fragment)
+	csv_file.close()
+
+def ndjson_to_csv(ndjson_file:open, csv_file, stream:bool=False, fieldnames:List[str]|None=None, sample:int|None=None, jobs:int=1, flat:bool=False) -> dict|None:
+	if jobs > 1 and sample is None and chunkable(ndjson_file):
+		ndjson_file.close()
+		parallel_csv(ndjson_file.name, csv_file, jobs, fieldnames=fieldnames, flat=flat)
+		return None
+	if stream or jobs > 1:
+		stream_csv(ndjson_file, csv_file, fieldnames=fieldnames, sample=sample, flat=flat)
+		return None
 	data = read_ndjson(ndjson_file)
+	if flat:
+		data = [flatten(item) for item in data]
 	write_csv(csv_file, data)
 	return data
 
+class ColumnTypeConflict(ValueError):
+	"""a value after the sampled records does not fit the inferred type of its column, or its column is not in the sample."""
+	def __init__(self, name:str, column_type:str|None, value:Any):
+		if column_type is None:
+			super().__init__("column %r is not in the sample, it first appears with value %r." % (name, value))
+		else:
+			super().__init__("column %r was inferred as %s from the sample, but a later value is %r." % (name, column_type, value))
+		self.name = name
+
+def write_parquet(records:Iterable[dict], parquet_path, types:Dict[str, str], row_group_size:int, check:bool=False, check_columns:bool=False):
+	"""
+	write flattened records with the column types, values of string columns which are not str are dumped as json.
+	with check, raise ColumnTypeConflict on a value which would be coerced into a numeric or bool column.
+	with check_columns, raise ColumnTypeConflict on a key which is not a column instead of dropping it.
+	"""
+	import pyarrow
+	import pyarrow.parquet
+
+	arrow_types = {
+		"null": pyarrow.string(),
+		"bool": pyarrow.bool_(),
+		"int": pyarrow.int64(),
+		"float": pyarrow.float64(),
+		"string": pyarrow.string(),
+	}
+	schema = pyarrow.schema([(name, arrow_types[tp]) for name, tp in types.items()])
+	columns = {name: [] for name in types}
+	string_columns = [name for name, tp in types.items() if tp in ("string", "null")]
+	typed_columns = [(name, tp) for name, tp in types.items() if tp not in ("string", "null")] if check else []
+	keys = types.keys()
+
+	def flush(writer):
+		for name in string_columns:
+			columns[name] = [v if v is None or isinstance(v, str) else json.dumps(v) for v in columns[name]]
+		writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+		for name in columns:
+			columns[name] = []
+
+	with pyarrow.parquet.ParquetWriter(parquet_path, schema, compression="zstd") as writer:
+		rows = 0
+		for item in records:
+			if check_columns and not keys >= item.keys():
+				name = next(key for key in item if key not in types)
+				raise ColumnTypeConflict(name, None, item[name])
+			for name, tp in typed_columns:
+				value = item.get(name)
+				if value is not None and merge_type(tp, value_type(value)) != tp:
+					raise ColumnTypeConflict(name, tp, value)
+			for name, column in columns.items():
+				column.append(item.get(name))
+			rows += 1
+			if rows % row_group_size == 0:
+				flush(writer)
+		if rows % row_group_size or not rows:
+			flush(writer)
+
+def ndjson_to_parquet(ndjson_file:open, parquet_path:str, fieldnames:List[str]|None=None, sample:int|None=None, row_group_size:int=128*1024):
+	"""
+	convert flattened records to a typed parquet file with constant memory.
+	column types are inferred by a scan pass, or from the first `sample` records.
+	titles from fieldnames are typed the same way, as string if the input can only be read once.
+	sampled types and titles are checked while writing. on a conflicting value or a title missed by the sample,
+	the types are scanned from the whole input and the file is written again if the input is seekable and
+	the output is a path, ColumnTypeConflict is raised otherwise.
+	rows are buffered into per-column lists and flushed every `row_group_size` rows.
+	"""
+	try:
+		import pyarrow
+	except ImportError:
+		raise ImportError("parquet output needs pyarrow, install it with `pip install pyarrow`.")
+
+	records = iter_ndjson(ndjson_file, flat=True)
+	if sample is not None:
+		head = list(itertools.islice(records, sample))
+		types = infer_types(head)
+		records = itertools.chain(head, records)
+	elif ndjson_file.seekable():
+		types = scan_types(ndjson_file)
+		rewind(ndjson_file)
+		records = iter_ndjson(ndjson_file, flat=True)
+	else:
+		types = {}
+	if fieldnames is not None:
+		types = {name: types.get(name, "string" if sample is None and not ndjson_file.seekable() else "null") for name in fieldnames}
+
+	try:
+		write_parquet(records, parquet_path, types, row_group_size, check=sample is not None, check_columns=sample is not None and fieldnames is None)
+	except ColumnTypeConflict:
+		if not (isinstance(parquet_path, str) and ndjson_file.seekable()):
+			if isinstance(parquet_path, str):
+				os.remove(parquet_path)
+			raise
+		# the sample was not representative, the scanned types are exact so one more pass is enough
+		rewind(ndjson_file)
+		scanned = scan_types(ndjson_file)
+		types = scanned if fieldnames is None else {name: scanned.get(name, "null") for name in fieldnames}
+		rewind(ndjson_file)
+		write_parquet(iter_ndjson(ndjson_file, flat=True), parquet_path, types, row_group_size)
+	ndjson_file.close()
+
+def detect_compression(head:bytes) -> str|None:
+	for name, magic in COMPRESSION_MAGIC.items():
+		if head.startswith(magic):
+			return name
+	return None
+
+def open_codec(fileobj, compression:str, mode:str):
+	if compression == "gz":
+		return gzip.GzipFile(fileobj=fileobj, mode=mode)
+	if compression == "bz2":
+		return bz2.BZ2File(fileobj, mode)
+	if compression == "xz":
+		return lzma.LZMAFile(fileobj, mode)
+	try:
+		import zstandard
+	except ImportError:
+		raise ImportError("zstd support needs zstandard, install it with `pip install zstandard`.")
+	if mode == "rb":
+		return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=BUFFER_SIZE, closefd=False)
+	return zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+
+class ThreadedReader(io.RawIOBase):
+	"""
+	decompress blocks of `raw` in a background thread, so decompression overlaps json parsing.
+	only rewinding to the beginning is supported, and only if `raw` is seekable.
+	"""
+	def __init__(self, raw, compression:str, block_size:int=BUFFER_SIZE, depth:int=4):
+		self.raw = raw
+		self.compression = compression
+		self.block_size = block_size
+		self.depth = depth
+		self.start()
+
+	def start(self):
+		self.source = open_codec(self.raw, self.compression, "rb")
+		self.queue = queue.Queue(self.depth)
+		self.pending = memoryview(b"")
+		self.eof = False
+		self.stopped = False
+		self.thread = threading.Thread(target=self.fill, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.stopped = True
+		while self.thread.is_alive():
+			try:
+				self.queue.get(timeout=0.1)
+			except queue.Empty:
+				pass
+
+	def fill(self):
+		try:
+			while not self.stopped:
+				block = self.source.read(self.block_size)
+				self.queue.put(block)
+				if not block:
+					break
+		except Exception as e:
+			self.queue.put(e)
+
+	def readable(self) -> bool:
+		return True
+
+	def seekable(self) -> bool:
+		return self.raw.seekable()
+
+	def seek(self, pos:int, whence:int=io.SEEK_SET) -> int:
+		if pos != 0 or whence != io.SEEK_SET:
+			raise io.UnsupportedOperation("ThreadedReader can only rewind to the beginning.")
+		self.stop()
+		self.source.close()
+		self.raw.seek(0)
+		self.start()
+		return 0
+
+	def readinto(self, b) -> int:
+		if not self.pending:
+			if self.eof:
+				return 0
+			block = self.queue.get()
+			if isinstance(block, Exception):
+				raise block
+			if not block:
+				self.eof = True
+				return 0
+			self.pending = memoryview(block)
+		n = min(len(b), len(self.pending))
+		b[:n] = self.pending[:n]
+		self.pending = self.pending[n:]
+		return n
+
+	def close(self):
+		if not self.closed:
+			self.stop()
+			self.source.close()
+			self.raw.close()
+		super().close()
+
+class ThreadedWriter(io.RawIOBase):
+	"""
+	write blocks to `sink` in a background thread, so compression overlaps csv formatting.
+	"""
+	def __init__(self, sink, closing:list=[], depth:int=4):
+		self.sink = sink
+		self.closing = closing
+		self.error = None
+		self.queue = queue.Queue(depth)
+		self.thread = threading.Thread(target=self.drain, daemon=True)
+		self.thread.start()
+
+	def drain(self):
+		while True:
+			block = self.queue.get()
+			if block is None:
+				break
+			if self.error is None:
+				try:
+					self.sink.write(block)
+				except Exception as e:
+					self.error = e
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, b) -> int:
+		if self.error is not None:
+			raise self.error
+		self.queue.put(bytes(b))
+		return len(b)
+
+	def close(self):
+		if not self.closed:
+			self.queue.put(None)
+			self.thread.join()
+			self.sink.close()
+			for item in self.closing:
+				item.close()
+		super().close()
+		if self.error is not None:
+			raise self.error
+
+def open_input(path:str, buffer_size:int=BUFFER_SIZE):
+	"""
+	open a ndjson file or stdin(`-`) as text, compression is detected by magic bytes.
+	"""
+	if path == "-":
+		raw = io.BufferedReader(io.FileIO(sys.stdin.fileno(), closefd=False), buffer_size)
+	else:
+		raw = open(path, "rb", buffering=buffer_size)
+	compression = detect_compression(raw.peek(6)[:6])
+	if compression is None:
+		return io.TextIOWrapper(raw, encoding="utf-8")
+	reader = ThreadedReader(raw, compression, block_size=buffer_size)
+	return io.TextIOWrapper(io.BufferedReader(reader, buffer_size), encoding="utf-8")
+
+def open_output(path:str, compression:str|None=None, buffer_size:int=BUFFER_SIZE):
+	"""
+	open a csv file or stdout(`-`) as text, optionally compressed.
+	"""
+	if path == "-":
+		sink = io.FileIO(sys.stdout.fileno(), "w", closefd=False)
+	else:
+		sink = io.FileIO(path, "w")
+	if compression is None:
+		return io.TextIOWrapper(io.BufferedWriter(sink, buffer_size), encoding="utf-8")
+	writer = ThreadedWriter(open_codec(sink, compression, "wb"), closing=[sink])
+	return io.TextIOWrapper(io.BufferedWriter(writer, buffer_size), encoding="utf-8")
+
+def chunkable(ndjson_file) -> bool:
+	name = getattr(ndjson_file, "name", None)
+	return isinstance(name, str) and os.path.isfile(name) and ndjson_file.seekable()
+# only plain uncompressed files can be split by byte offsets
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(prog='ndjson2csv.py', description='Convert ndjson file to csv format file.')
-	parser.add_argument('ndjson_file', type=open, help='ndjson filename')
-	parser.add_argument('-o', '--output', type=argparse.FileType('w', encoding='utf-8'), required=False, help='csv filename')
+	parser.add_argument('ndjson_file', type=str, help='ndjson filename, `-` for stdin, gz/bz2/xz/zst input is detected')
+	parser.add_argument('-o', '--output', type=str, required=False, help='output filename, `-` for stdout')
+	parser.add_argument('-z', '--compress', default=None, choices=list(COMPRESSION_MAGIC), help='compress the csv output')
+	parser.add_argument('-f', '--format', default='csv', choices=['csv', 'parquet'], help='output format, parquet needs pyarrow and always flattens')
+	parser.add_argument('--flatten', action='store_true', help='flatten nested objects as dotted titles, arrays are kept as json')
+	parser.add_argument('--stream', action='store_true', help='convert record by record with constant memory, the file is read twice')
+	parser.add_argument('--schema', type=argparse.FileType('r', encoding='utf-8'), default=None, help='read csv titles from this file instead of scanning, implies --stream')
+	parser.add_argument('--sample', type=int, default=None, help='collect csv titles from the first SAMPLE records only, implies --stream')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='parse json in JOBS processes, the output is the same as --stream')
 	args = parser.parse_args()
 	if args.output is None:
-		args.output = open(args.ndjson_file.name + '.csv', 'w', encoding='utf-8')
-	ndjson_to_csv(args.ndjson_file, args.output)
+		if args.ndjson_file == '-':
+			args.output = '-'
+		else:
+			args.output = args.ndjson_file + '.' + args.format + ('.' + args.compress if args.compress and args.format == 'csv' else '')
+	fieldnames = read_schema(args.schema) if args.schema else None
+	stream = args.stream or fieldnames is not None or args.sample is not None or args.jobs > 1
+	ndjson_file = open_input(args.ndjson_file)
+	if (stream or args.format == 'parquet') and fieldnames is None and args.sample is None and not ndjson_file.seekable():
+		parser.error('titles of a piped input can not be scanned twice, give --schema or --sample.')
+	if args.format == 'parquet':
+		try:
+			ndjson_to_parquet(ndjson_file, sys.stdout.buffer if args.output == '-' else args.output, fieldnames=fieldnames, sample=args.sample)
+		except ColumnTypeConflict as e:
+			sys.exit('%s the piped input can not be written again, give a larger --sample.' % e)
+		sys.exit(0)
+	csv_file = open_output(args.output, compression=args.compress)
+	ndjson_to_csv(ndjson_file, csv_file, stream=stream, fieldnames=fieldnames, sample=args.sample, jobs=args.jobs, flat=args.flatten)
@@ -1,5 +1,12 @@
 import argparse
+import asyncio
+import json
 import os
+import re
+import shutil
+import sys
+import tempfile
+import time
 
 def insert_auth(config:list, name:str, auth_file):
 	assert os.path.exists(auth_file), auth_file
@@ -52,9 +59,198 @@ def pipeline(config:list, tmp_config_fn:str):
 	input('Press Enter to stop VPN:')
 	os.system(f'openvpn3 session-manage --config {tmp_config_fn} --disconnect')
 
+def iter_ovpn_files(paths:list):
+	for path in paths:
+		if os.path.isdir(path):
+			for fn in sorted(os.listdir(path)):
+				if fn.endswith('.ovpn'):
+					yield os.path.join(path, fn)
+		else:
+			yield path
+
+def write_config_atomic(config:list, path:str):
+	"""
+	the config has credentials, write it owner only and rename it in place.
+	"""
+	tmp_path = path + '.tmp'
+	fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+	with os.fdopen(fd, 'w') as tf:
+		tf.writelines(config)
+	os.replace(tmp_path, path)
+
+def write_configs(configs:dict, tmp_dir:str) -> dict:
+	"""
+	write {name: config lines} into tmp_dir, return {name: config path}.
+	"""
+	paths = {}
+	for name, config in configs.items():
+		paths[name] = os.path.join(tmp_dir, name + '.ovpn')
+		write_config_atomic(config, paths[name])
+	return paths
+
+async def run_command(args:list, timeout:float=None) -> (int, str):
+	"""
+	run a command without stdin, return its exit code and output, killed on timeout with exit code None.
+	the command is also killed when the task is cancelled, so it does not outlive the teardown.
+	"""
+	proc = await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+	try:
+		out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+	except asyncio.TimeoutError:
+		proc.kill()
+		await proc.wait()
+		return None, "timeout after %ss" % timeout
+	except asyncio.CancelledError:
+		if proc.returncode is None:
+			proc.kill()
+			await proc.wait()
+		raise
+	return proc.returncode, out.decode(errors='replace')
+
+CONFIG_NOTE_RE = re.compile(r'\s+\([^()]*\)$')
+
+def parse_sessions_list(text:str) -> dict:
+	"""
+	{config name: status} from the `openvpn3 sessions-list` output.
+	"""
+	sessions = {}
+	for block in text.split('\n-'):
+		fields = {}
+		for line in block.splitlines():
+			key, sep, value = line.partition(':')
+			if sep:
+				fields[key.strip()] = value.strip()
+		if 'Config name' in fields:
+			# configs started by path are listed as `/path/x.ovpn  (Config not available)`
+			sessions[CONFIG_NOTE_RE.sub('', fields['Config name']).strip()] = fields.get('Status', '')
+	return sessions
+
+class SessionStatus:
+	"""
+	share one `openvpn3 sessions-list` run per interval among all the waiting sessions.
+	"""
+	def __init__(self, openvpn3:str="openvpn3", interval:float=1.0):
+		self.openvpn3 = openvpn3
+		self.interval = interval
+		self.lock = asyncio.Lock()
+		self.stamp = None
+		self.sessions = {}
+
+	async def get(self, config_path:str) -> str:
+		async with self.lock:
+			if self.stamp is None or time.monotonic() - self.stamp >= self.interval:
+				code, out = await run_command([self.openvpn3, 'sessions-list'], self.interval * 10)
+				self.sessions = parse_sessions_list(out) if code == 0 else {}
+				self.stamp = time.monotonic()
+		return self.sessions.get(config_path)
+
+async def wait_enter(prompt:str):
+	"""
+	wait for Enter or the end of stdin without blocking a thread.
+	a thread blocked in input() keeps asyncio.run, and even interpreter shutdown, waiting after Ctrl-C.
+	"""
+	print(prompt, end='', flush=True)
+	loop = asyncio.get_running_loop()
+	future = loop.create_future()
+	fd = sys.stdin.fileno()
+	def read():
+		data = os.read(fd, 4096)
+		if (not data or b'\n' in data) and not future.done():
+			future.set_result(None)
+	try:
+		loop.add_reader(fd, read)
+	except (PermissionError, NotImplementedError):
+		# regular files can not be polled, and never block
+		sys.stdin.readline()
+		return
+	try:
+		await future
+	finally:
+		loop.remove_reader(fd)
+
+def new_report(name:str, config_path:str) -> dict:
+	return {"name": name, "config": config_path, "started": False, "status": "failed", "latency": None, "error": None}
+
+async def connect_session(report:dict, semaphore:asyncio.Semaphore, status:SessionStatus, timeout:float=60) -> dict:
+	"""
+	start the session of a report from new_report and poll until it is connected, failed or timeout.
+	the report is filled in place with the connect latency in seconds, so it can be torn down when interrupted.
+	"""
+	config_path = report["config"]
+	async with semaphore:
+		start = time.monotonic()
+		# marked before session-start returns, an interrupted or killed start may have created the session
+		report["started"] = True
+		code, out = await run_command([status.openvpn3, 'session-start', '--config', config_path], timeout)
+		if code is not None and code != 0:
+			report["started"] = False
+		if code != 0:
+			report["status"] = "timeout" if code is None else "failed"
+			report["error"] = out.strip().splitlines()[-1] if out.strip() else "exit code %s" % code
+			return report
+		while True:
+			state = await status.get(config_path) or ''
+			if 'Client connected' in state:
+				report["status"] = "connected"
+				report["latency"] = time.monotonic() - start
+				return report
+			if 'fail' in state.lower() or 'disconnected' in state.lower():
+				report["error"] = state
+				return report
+			if time.monotonic() - start > timeout:
+				report["status"] = "timeout"
+				report["error"] = state or "session not listed"
+				return report
+			await asyncio.sleep(status.interval)
+
+async def disconnect_session(report:dict, semaphore:asyncio.Semaphore, openvpn3:str="openvpn3", timeout:float=60):
+	async with semaphore:
+		code, out = await run_command([openvpn3, 'session-manage', '--config', report["config"], '--disconnect'], timeout)
+		if code != 0 and report["status"] == "connected":
+			print(f'Disconnect {report["name"]} failed: {out.strip()}')
+
+def print_batch_report(reports:list):
+	for report in sorted(reports, key=lambda report: report["name"]):
+		latency = "%8.0f ms" % (report["latency"] * 1000) if report["latency"] is not None else " " * 11
+		print(f'{report["name"]:<32} {report["status"]:<10} {latency}  {report["error"] or ""}')
+	latencies = sorted(report["latency"] for report in reports if report["latency"] is not None)
+	print(f'{len(latencies)} of {len(reports)} sessions connected.', end='')
+	if latencies:
+		print(' latency p50 %.0f ms, p95 %.0f ms, max %.0f ms.' % (latencies[len(latencies) // 2] * 1000, latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, latencies[-1] * 1000), end='')
+	print()
+
+async def batch_pipeline(configs:dict, openvpn3:str="openvpn3", jobs:int=16, timeout:float=60, poll_interval:float=1.0, hold:float=None) -> list:
+	"""
+	bring up the sessions of {name: config lines} concurrently, hold them, then tear all down.
+	hold is in seconds, wait for Enter if None.
+	the combined configs only exist in a private temporary folder during the run.
+	"""
+	tmp_dir = tempfile.mkdtemp(prefix='openvpn2to3-')
+	reports = []
+	try:
+		paths = write_configs(configs, tmp_dir)
+		print(f'Combined config files are writed to {tmp_dir}.')
+		semaphore = asyncio.Semaphore(jobs)
+		status = SessionStatus(openvpn3, poll_interval)
+		reports = [new_report(name, path) for name, path in paths.items()]
+		try:
+			await asyncio.gather(*(connect_session(report, semaphore, status, timeout) for report in reports))
+			print_batch_report(reports)
+			if hold is None:
+				await wait_enter('Press Enter to stop VPN:')
+			else:
+				await asyncio.sleep(hold)
+		finally:
+			await asyncio.gather(*(disconnect_session(report, semaphore, openvpn3, timeout) for report in reports if report["started"]))
+	finally:
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+	return reports
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Combining the start command line of openvpn2.x to the .ovpn config file for openvpn3.x")
-	parser.add_argument("--config", type=str, required=True)
+	source = parser.add_mutually_exclusive_group(required=True)
+	source.add_argument("--config", type=str)
+	source.add_argument("-b", "--batch", nargs="+", type=str, help="Start sessions of many .ovpn files or folders of them concurrently, with the same options.")
 	parser.add_argument("--auth-user-pass", type=str, default=None)
 	parser.add_argument("--http-proxy-retry", action='store_true', default=None)
 	parser.add_argument("--http-proxy", nargs=2, type=str, default=None)
@@ -65,11 +261,40 @@ if __name__ == '__main__':
 	parser.add_argument("--data-ciphers-fallback", type=str, default=None)
 	parser.add_argument("-s", "--only-show-combined", action='store_true', help="Only print the ovpn config file without write and run.")
 	parser.add_argument("-o", "--tmp-config-fn", type=str, default="__.ovpn")
+	parser.add_argument("-j", "--jobs", type=int, default=16, help="Sessions started or stopped at the same time in batch.")
+	parser.add_argument("--connect-timeout", type=float, default=60, help="Seconds to wait for a session to connect in batch.")
+	parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of the sessions status in batch.")
+	parser.add_argument("--hold", type=float, default=None, help="Seconds to keep the sessions up in batch, wait for Enter by default.")
+	parser.add_argument("--report", type=str, default=None, help="Json file to save the sessions report of batch.")
+	parser.add_argument("--openvpn3", type=str, default="openvpn3", help="The openvpn3 executable.")
 
 	args = parser.parse_args()
 	print(args.http_proxy_option)
 	assert not args.socks_proxy, "socks-proxy is not support in 3.x version."
 
+	if args.batch:
+		configs = {}
+		for ovpn_file in iter_ovpn_files(args.batch):
+			name = base = os.path.splitext(os.path.basename(ovpn_file))[0]
+			suffix = 1
+			while name in configs:
+				suffix += 1
+				name = f'{base}_{suffix}'
+			configs[name] = combine_config(ovpn_file, auth_user_pass=args.auth_user_pass, http_proxy=args.http_proxy, http_proxy_user_pass=args.http_proxy_user_pass, http_proxy_option=args.http_proxy_option, data_ciphers=args.data_ciphers, data_ciphers_fallback=args.data_ciphers_fallback)
+		if args.only_show_combined:
+			for name, config in configs.items():
+				print(f'# {name}\n' + "".join(config))
+			exit(0)
+		try:
+			reports = asyncio.run(batch_pipeline(configs, openvpn3=args.openvpn3, jobs=args.jobs, timeout=args.connect_timeout, poll_interval=args.poll_interval, hold=args.hold))
+		except KeyboardInterrupt:
+			print('Interrupted, the started sessions are disconnected.')
+			exit(130)
+		if args.report:
+			with open(args.report, 'w') as rf:
+				json.dump(reports, rf, indent=1)
+		exit(0 if all(report["status"] == "connected" for report in reports) else 1)
+
 	config = combine_config(args.config, auth_user_pass=args.auth_user_pass, http_proxy=args.http_proxy, http_proxy_user_pass=args.http_proxy_user_pass, http_proxy_option=args.http_proxy_option, data_ciphers=args.data_ciphers, data_ciphers_fallback=args.data_ciphers_fallback)
 	if args.only_show_combined:
 		print("".join(config))
@@ -1,6 +1,33 @@
 import argparse
+import array
+import bisect
+import concurrent.futures
+import contextlib
+import glob
+import io
+import itertools
+import json
+import mmap
+import operator
+import os
 import struct
-from typing import List, Dict, Tuple, Any
+import sys
+from typing import List, Dict, Tuple, Any, BinaryIO, Iterator
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+CONTAINER_TYPES = {"moov", "trak", "mdia", "minf", "stbl", "edts", "udta",
+	"mvex", "moof", "traf", "mfra", "dinf"}
+CONTAINER_SKIP = {
+	"stsd": 8, "meta": 4,
+	"avc1": 78, "avc3": 78, "hvc1": 78, "hev1": 78, "av01": 78, "vp09": 78, "mp4v": 78,
+	"mp4a": 28, "ac-3": 28, "ec-3": 28, "Opus": 28, "fLaC": 28,
+}
+# bytes before children of stsd(full box + entry count), meta(full box) and sample entries(sample entry fields).
+# only parse_atom_tree descends into these.
 
 def read_atom(data:bytes, pos:int) -> Tuple[int, str, int, bytes]:
 	size, atom_type = struct.unpack(">I4s", data[pos:pos+8])
@@ -51,15 +78,568 @@ def parse_atoms(data:bytes, start:int=0, end:int|None=None, depth:int=0) -> List
 		}
 
 		# if the atom has children, parse sub-atom recurrently.
-		if tp in {"moov", "trak", "mdia", "mdhd", "minf", "stbl", "edts", "udta",
-			"edts", "udta", "meta", "free", "skip", "mvex"}:
+		if tp in CONTAINER_TYPES:
 			atom["children"] = parse_atoms(payload, 0, len(payload), depth+1)
 		atoms.append(atom)
 		pos += size
 
 	return atoms
 
-def find_atoms(atoms:List[Dict[str, Any]], tp:str) -> List[Dict[str, Any]]:
+def read_atom_header(f:BinaryIO, pos:int) -> Tuple[int, str, int]:
+	f.seek(pos)
+	head = f.read(8)
+	if len(head) < 8:
+		raise EOFError("atom header at %d is truncated." % pos)
+	size, atom_type = struct.unpack(">I4s", head)
+	header_len = 8
+	if size == 1:
+		ext = f.read(8)
+		if len(ext) < 8:
+			raise EOFError("atom largesize at %d is truncated." % pos)
+		size = struct.unpack(">Q", ext)[0]
+		header_len = 16
+	return size, atom_type.decode("latin-1"), header_len
+
+class Atom:
+	"""
+	compact atom node without payload copy, children is a tuple for leaf atoms.
+	atom["type"] style access is kept, so it works with find_atoms and show_atoms.
+	"""
+	__slots__ = ("type", "size", "offset", "header_len", "children")
+
+	def __init__(self, tp:str, size:int, offset:int, header_len:int, children:list|tuple=()):
+		self.type = tp
+		self.size = size
+		self.offset = offset
+		self.header_len = header_len
+		self.children = children
+
+	def __getitem__(self, key:str):
+		if key not in self.__slots__:
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __repr__(self) -> str:
+		return f"Atom({self.type!r}, size={self.size}, offset={self.offset})"
+
+	@property
+	def payload_offset(self) -> int:
+		return self.offset + self.header_len
+
+	@property
+	def end(self) -> int:
+		return self.offset + self.size
+
+	def payload(self, buf) -> memoryview:
+		return memoryview(buf)[self.payload_offset:self.end]
+	# zero-copy payload, `buf` is the whole file as mmap(see map_file) or bytes
+
+	def walk(self) -> Iterator["Atom"]:
+		stack = [self]
+		while stack:
+			atom = stack.pop()
+			yield atom
+			stack.extend(reversed(atom.children))
+	# pre-order iterate the atom and all its descendants
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {
+			"type": self.type,
+			"size": self.size,
+			"offset": self.offset,
+			"header_len": self.header_len,
+			"children": [child.to_dict() for child in self.children]
+		}
+
+class AtomTree:
+	"""
+	top level atoms of a file and a {type: [Atom]} index in file order.
+	"""
+	__slots__ = ("atoms", "index")
+
+	def __init__(self, atoms:List[Atom], index:Dict[str, List[Atom]]):
+		self.atoms = atoms
+		self.index = index
+
+	def __iter__(self) -> Iterator[Atom]:
+		return iter(self.atoms)
+
+	def find(self, tp:str) -> Iterator[Atom]:
+		return iter(self.index.get(tp, ()))
+
+	def to_dicts(self) -> List[Dict[str, Any]]:
+		return [atom.to_dict() for atom in self.atoms]
+
+def parse_atom_nodes(f:BinaryIO, start:int, end:int, index:Dict[str, List[Atom]]) -> List[Atom]:
+	atoms: List[Atom] = []
+
+	pos = start
+	while pos + 8 <= end:
+		try:
+			size, tp, hlen = read_atom_header(f, pos)
+		except Exception as e:
+			print(e)
+			print("There is break atom in the file, stop parse.")
+			break
+		if size == 0:
+			size = end - pos
+		if size < hlen:
+			print("Atom %s at %d has invalid size %d, stop parse." % (tp, pos, size))
+			break
+
+		atom = Atom(tp, size, pos, hlen)
+		index.setdefault(tp, []).append(atom)
+		if tp in CONTAINER_TYPES:
+			atom.children = parse_atom_nodes(f, pos+hlen, min(pos+size, end), index)
+		elif tp in CONTAINER_SKIP:
+			atom.children = parse_atom_nodes(f, pos+hlen+CONTAINER_SKIP[tp], min(pos+size, end), index)
+		atoms.append(atom)
+		pos += size
+
+	return atoms
+
+def parse_atom_tree(f:BinaryIO, start:int=0, end:int|None=None) -> AtomTree:
+	"""
+	lazy parse an opened file, only atom headers are read from the file.
+	leaf payloads such as `mdat` are skipped by seek, containers are parsed by offset.
+	"offset" is relative to the beginning of whole file.
+	"""
+	if end is None:
+		end = os.fstat(f.fileno()).st_size
+	index: Dict[str, List[Atom]] = {}
+	atoms = parse_atom_nodes(f, start, end, index)
+	return AtomTree(atoms, index)
+
+def parse_atoms_file(f:BinaryIO, start:int=0, end:int|None=None) -> List[Dict[str, Any]]:
+	"""
+	dict output of parse_atom_tree, same as parse_atoms without "payload".
+	use atom_payload to fetch the payload on demand.
+	"""
+	return parse_atom_tree(f, start, end).to_dicts()
+
+def map_file(f:BinaryIO) -> mmap.mmap:
+	return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def atom_payload(buf, atom:Dict[str, Any]) -> memoryview:
+	"""
+	zero-copy payload of an atom from parse_atoms_file.
+	`buf` is the whole file as mmap(see map_file) or bytes.
+	"""
+	start = atom["offset"] + atom["header_len"]
+	return memoryview(buf)[start:atom["offset"]+atom["size"]]
+
+def unpack_array(buf, offset:int, count:int, itemsize:int=4):
+	"""
+	bulk unpack `count` big-endian unsigned integers.
+	return numpy int64 array if numpy is installed, else array.array.
+	"""
+	if numpy is not None:
+		dtype = ">u4" if itemsize == 4 else ">u8"
+		return numpy.frombuffer(buf, dtype=dtype, count=count, offset=offset).astype(numpy.int64)
+	arr = array.array("I" if itemsize == 4 else "Q")
+	arr.frombytes(buf[offset:offset+count*itemsize])
+	if sys.byteorder == "little":
+		arr.byteswap()
+	return arr
+
+def decode_stts(payload) -> Tuple[Any, Any]:
+	"""return (sample_counts, sample_deltas)."""
+	count = struct.unpack_from(">I", payload, 4)[0]
+	table = unpack_array(payload, 8, count*2)
+	return table[0::2], table[1::2]
+
+def decode_stsc(payload) -> Tuple[Any, Any, Any]:
+	"""return (first_chunks, samples_per_chunk, sample_description_indexes), chunks are 1-based."""
+	count = struct.unpack_from(">I", payload, 4)[0]
+	table = unpack_array(payload, 8, count*3)
+	return table[0::3], table[1::3], table[2::3]
+
+def decode_stsz(payload):
+	"""return size of every sample."""
+	sample_size, count = struct.unpack_from(">II", payload, 4)
+	if sample_size:
+		if numpy is not None:
+			return numpy.full(count, sample_size, dtype=numpy.int64)
+		return array.array("I", [sample_size]) * count
+	return unpack_array(payload, 12, count)
+
+def decode_stco(payload):
+	"""return chunk offsets."""
+	count = struct.unpack_from(">I", payload, 4)[0]
+	return unpack_array(payload, 8, count)
+
+def decode_co64(payload):
+	count = struct.unpack_from(">I", payload, 4)[0]
+	return unpack_array(payload, 8, count, itemsize=8)
+
+def decode_stss(payload):
+	"""return sync sample numbers, samples are 1-based."""
+	count = struct.unpack_from(">I", payload, 4)[0]
+	return unpack_array(payload, 8, count)
+
+def decode_mdhd(payload) -> Tuple[int, int]:
+	"""return (timescale, duration), also for mvhd which has the same layout."""
+	if payload[0] == 1:
+		return struct.unpack_from(">IQ", payload, 20)
+	return struct.unpack_from(">II", payload, 12)
+
+def search_right(arr, value) -> int:
+	if numpy is not None and isinstance(arr, numpy.ndarray):
+		return int(numpy.searchsorted(arr, value, "right"))
+	return bisect.bisect_right(arr, value)
+
+class SampleIndex:
+	"""
+	per-sample table of a track, decode timestamps are in `timescale` units.
+	sync is the 0-based keyframe sample list, None means every sample is a keyframe.
+	"""
+	__slots__ = ("track_id", "timescale", "duration", "offsets", "sizes", "dts", "sync")
+
+	def __init__(self, track_id:int, timescale:int, duration:int, offsets, sizes, dts, sync):
+		self.track_id = track_id
+		self.timescale = timescale
+		self.duration = duration
+		self.offsets = offsets
+		self.sizes = sizes
+		self.dts = dts
+		self.sync = sync
+
+	def __len__(self) -> int:
+		return len(self.sizes)
+
+	def sample_at(self, t:float) -> int:
+		"""index of the sample shown at `t` seconds."""
+		return max(search_right(self.dts, t * self.timescale) - 1, 0)
+
+	def keyframe_at(self, t:float) -> int:
+		"""index of the last keyframe not after `t` seconds."""
+		sample = self.sample_at(t)
+		if self.sync is None or not len(self.sync):
+			return sample
+		return int(self.sync[max(search_right(self.sync, sample) - 1, 0)])
+
+	def byte_range(self, start:float, end:float|None=None, keyframe:bool=True) -> Tuple[int, int]:
+		"""
+		[first, last) byte range of the samples from `start` to `end` seconds.
+		the range begins at the keyframe before `start` if keyframe is True.
+		"""
+		first = self.keyframe_at(start) if keyframe else self.sample_at(start)
+		last = self.sample_at(end) if end is not None else first
+		last = max(first, last)
+		return int(self.offsets[first]), int(self.offsets[last] + self.sizes[last])
+
+def build_offsets(chunk_offsets, first_chunks, samples_per_chunk, sizes):
+	"""
+	expand chunk offsets and stsc runs to per-sample offsets.
+	offset of sample i in chunk c is chunk_offsets[c] + cumsize[i] - cumsize[first sample of c].
+	"""
+	n = len(sizes)
+	nchunks = len(chunk_offsets)
+	if numpy is not None:
+		runs = numpy.diff(numpy.append(first_chunks, nchunks + 1))
+		spc = numpy.repeat(samples_per_chunk, numpy.maximum(runs, 0))
+		chunk_of = numpy.repeat(numpy.arange(len(spc)), spc)[:n]
+		cumsize = numpy.concatenate(([0], numpy.cumsum(sizes)))
+		first = numpy.minimum(numpy.concatenate(([0], numpy.cumsum(spc)))[:-1], n)
+		bases = chunk_offsets[:len(spc)] - cumsize[first]
+		return bases[chunk_of] + cumsize[:len(chunk_of)]
+
+	bounds = list(first_chunks) + [nchunks + 1]
+	spc = list(itertools.chain.from_iterable(
+		itertools.repeat(k, max(bounds[i+1] - bounds[i], 0)) for i, k in enumerate(samples_per_chunk)))
+	cumsize = array.array("q", itertools.accumulate(sizes, initial=0))
+	first = itertools.accumulate(spc, initial=0)
+	bases = (offset - cumsize[min(f, n)] for offset, f in zip(chunk_offsets, first))
+	per_sample = itertools.chain.from_iterable(itertools.repeat(b, k) for b, k in zip(bases, spc))
+	return array.array("q", map(operator.add, per_sample, itertools.islice(cumsize, n)))
+
+def build_dts(counts, deltas, n:int):
+	if numpy is not None:
+		return numpy.concatenate(([0], numpy.cumsum(numpy.repeat(deltas, counts))))[:n]
+	steps = itertools.chain.from_iterable(itertools.repeat(d, c) for c, d in zip(counts, deltas))
+	return array.array("q", itertools.islice(itertools.accumulate(steps, initial=0), n))
+
+def build_sample_index(buf, trak:Atom) -> SampleIndex|None:
+	"""
+	build the sample index of a `trak` atom from parse_atom_tree.
+	`buf` is the whole file as mmap(see map_file) or bytes.
+	return None if the track has no sample tables, such as in fragmented files.
+	"""
+	tables = {}
+	for atom in trak.walk():
+		if atom.type in ("tkhd", "mdhd", "stts", "stsc", "stsz", "stco", "co64", "stss"):
+			tables.setdefault(atom.type, atom.payload(buf))
+	# decoded tables are copies, the views are released so the mmap can be closed even after an error
+	try:
+		if not {"mdhd", "stts", "stsc", "stsz"} <= tables.keys() or not {"stco", "co64"} & tables.keys():
+			return None
+
+		tkhd = tables.get("tkhd")
+		track_id = 0
+		if tkhd is not None:
+			track_id = struct.unpack_from(">I", tkhd, 20 if tkhd[0] == 1 else 12)[0]
+		timescale, duration = decode_mdhd(tables["mdhd"])
+		sizes = decode_stsz(tables["stsz"])
+		chunk_offsets = decode_co64(tables["co64"]) if "co64" in tables else decode_stco(tables["stco"])
+		first_chunks, samples_per_chunk, _ = decode_stsc(tables["stsc"])
+		offsets = build_offsets(chunk_offsets, first_chunks, samples_per_chunk, sizes)
+		counts, deltas = decode_stts(tables["stts"])
+		dts = build_dts(counts, deltas, len(sizes))
+		sync = None
+		if "stss" in tables:
+			sync = decode_stss(tables["stss"])
+			sync = sync - 1 if numpy is not None else array.array("q", (s - 1 for s in sync))
+		return SampleIndex(track_id, timescale, duration, offsets, sizes, dts, sync)
+	finally:
+		for view in tables.values():
+			view.release()
+
+def build_sample_indexes(buf, tree:AtomTree) -> List[SampleIndex]:
+	indexes = [build_sample_index(buf, trak) for trak in tree.find("trak")]
+	return [index for index in indexes if index is not None]
+
+def describe_track(buf, trak:Atom) -> Dict[str, Any]:
+	"""
+	track summary from the small header atoms, sample tables are not decoded.
+	"""
+	info: Dict[str, Any] = {"track_id": None, "handler": None, "codec": None, "timescale": None, "duration": None, "samples": None}
+	for atom in trak.walk():
+		# released on errors too, a view kept alive by the traceback would fail closing the mmap
+		with atom.payload(buf) as payload:
+			if atom.type == "tkhd" and info["track_id"] is None:
+				info["track_id"] = struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)[0]
+			elif atom.type == "mdhd" and info["timescale"] is None:
+				timescale, duration = decode_mdhd(payload)
+				info["timescale"] = timescale
+				info["duration"] = duration / timescale if timescale else None
+			elif atom.type == "hdlr" and info["handler"] is None:
+				info["handler"] = bytes(payload[8:12]).decode("latin-1")
+			elif atom.type == "stsd" and info["codec"] is None and atom.children:
+				info["codec"] = atom.children[0].type
+			elif atom.type == "stsz" and info["samples"] is None:
+				info["samples"] = struct.unpack_from(">I", payload, 8)[0]
+	return info
+
+def describe_file(path:str) -> Dict[str, Any]:
+	"""
+	machine-readable header report of a file, errors are reported in the record.
+	messages printed by the parser are collected as "warnings".
+	"""
+	record: Dict[str, Any] = {"path": path, "size": None, "mtime": None, "duration": None, "tracks": [], "atoms": [], "warnings": [], "error": None}
+	messages = io.StringIO()
+	try:
+		stat = os.stat(path)
+		record["size"] = stat.st_size
+		record["mtime"] = stat.st_mtime
+		with open(path, "rb") as f, contextlib.redirect_stdout(messages):
+			tree = parse_atom_tree(f)
+			record["atoms"] = tree.to_dicts()
+			with map_file(f) as buf:
+				for mvhd in tree.find("mvhd"):
+					with mvhd.payload(buf) as payload:
+						timescale, duration = decode_mdhd(payload)
+					record["duration"] = duration / timescale if timescale else None
+					break
+				record["tracks"] = [describe_track(buf, trak) for trak in tree.find("trak")]
+	except Exception as e:
+		record["error"] = f"{type(e).__name__}: {e}"
+	record["warnings"] = messages.getvalue().splitlines()
+	return record
+
+def iter_media_files(patterns:List[str], extensions:Tuple[str, ...]=(".mp4", ".m4v", ".m4a", ".mov")) -> Iterator[str]:
+	"""
+	expand files, directories(walked recursively) and glob patterns.
+	files inside directories are filtered by extensions, explicit files are always kept.
+	"""
+	for pattern in patterns:
+		paths = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+		for path in sorted(paths):
+			if os.path.isdir(path):
+				for root, dirs, files in os.walk(path):
+					dirs.sort()
+					for fn in sorted(files):
+						if fn.lower().endswith(extensions):
+							yield os.path.join(root, fn)
+			else:
+				yield path
+
+def load_scan_cache(cache_path:str) -> Dict[str, Dict[str, Any]]:
+	cache = {}
+	if cache_path and os.path.exists(cache_path):
+		with open(cache_path, encoding="utf-8") as f:
+			for line in f:
+				if line.strip():
+					record = json.loads(line)
+					cache[record["path"]] = record
+	return cache
+
+def save_scan_cache(cache_path:str, records:List[Dict[str, Any]]):
+	tmp_path = cache_path + ".tmp"
+	with open(tmp_path, "w", encoding="utf-8") as f:
+		for record in records:
+			f.write(json.dumps(record, ensure_ascii=False) + "\n")
+	os.replace(tmp_path, cache_path)
+
+def scan_files(paths:List[str], jobs:int=1, cache:Dict[str, Dict[str, Any]]|None=None) -> Iterator[Dict[str, Any]]:
+	"""
+	describe files in a process pool and yield records in input order.
+	records in `cache` are reused if (path, size, mtime) is unchanged.
+	"""
+	cache = cache or {}
+	todo = []
+	for path in paths:
+		record = cache.get(path)
+		try:
+			stat = os.stat(path)
+		except OSError:
+			stat = None
+		if record is None or stat is None or record["size"] != stat.st_size or record["mtime"] != stat.st_mtime or record["error"]:
+			todo.append(path)
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+		fresh = executor.map(describe_file, todo, chunksize=8)
+		todo = set(todo)
+		for path in paths:
+			yield next(fresh) if path in todo else cache[path]
+
+def pack_atom(tp:str, body:bytes) -> bytes:
+	if len(body) + 8 < 2**32:
+		return struct.pack(">I4s", len(body) + 8, tp.encode("latin-1")) + body
+	return struct.pack(">I4sQ", 1, tp.encode("latin-1"), len(body) + 16) + body
+
+def pack_offsets(offsets, itemsize:int) -> bytes:
+	arr = array.array("I" if itemsize == 4 else "Q", (int(o) for o in offsets))
+	if sys.byteorder == "little":
+		arr.byteswap()
+	return arr.tobytes()
+
+def patch_chunk_offsets(data:bytes, shift, promote:bool=False) -> bytes:
+	"""
+	rebuild atoms in `data` with stco/co64 chunk offsets mapped by `shift`.
+	only moov/trak/mdia/minf/stbl are rebuilt, other atoms are copied as is.
+	stco becomes co64 if promote is True, OverflowError if an offset needs co64.
+	"""
+	out = bytearray()
+	pos = 0
+	while pos + 8 <= len(data):
+		size, tp, hlen, payload = read_atom(data, pos)
+		if size == 0:
+			size = len(data) - pos
+			payload = data[pos+hlen:]
+		if tp in ("moov", "trak", "mdia", "minf", "stbl"):
+			out += pack_atom(tp, patch_chunk_offsets(payload, shift, promote))
+		elif tp in ("stco", "co64"):
+			offsets = decode_stco(payload) if tp == "stco" else decode_co64(payload)
+			offsets = shift(offsets)
+			if tp == "stco" and promote:
+				tp = "co64"
+			body = payload[:8] + pack_offsets(offsets, 4 if tp == "stco" else 8)
+			out += pack_atom(tp, body)
+		else:
+			out += data[pos:pos+size]
+		pos += size
+	return bytes(out)
+
+def copy_range(fin, fout, offset:int, length:int, buffer_size:int=8*1024*1024):
+	"""
+	copy `length` bytes at `offset` of fin to the current position of fout.
+	use copy_file_range or sendfile in kernel when possible, else buffered copy.
+	both files should be unbuffered(buffering=0).
+	"""
+	copied = 0
+	for name in ("copy_file_range", "sendfile"):
+		if not hasattr(os, name):
+			continue
+		try:
+			while copied < length:
+				if name == "copy_file_range":
+					n = os.copy_file_range(fin.fileno(), fout.fileno(), length - copied, offset + copied)
+				else:
+					n = os.sendfile(fout.fileno(), fin.fileno(), offset + copied, length - copied)
+				if n == 0:
+					return copied
+				copied += n
+			return copied
+		except OSError:
+			continue
+	fin.seek(offset + copied)
+	while copied < length:
+		block = fin.read(min(buffer_size, length - copied))
+		if not block:
+			break
+		fout.write(block)
+		copied += len(block)
+	return copied
+
+def faststart(src_path:str, dst_path:str) -> bool:
+	"""
+	rewrite the file with moov before the first mdat and patch stco/co64 chunk offsets.
+	stco is promoted to co64 when a moved offset no longer fits 32 bits.
+	other atoms are streamed to dst_path without loading them into memory.
+	return False and write nothing if moov is already before mdat.
+	"""
+	with open(src_path, "rb", buffering=0) as fin:
+		with contextlib.redirect_stdout(io.StringIO()) as messages:
+			top = parse_atom_tree(fin).atoms
+		types = [atom.type for atom in top]
+		if "moov" not in types or "mdat" not in types:
+			raise ValueError("%s has no moov or mdat atom. %s" % (src_path, messages.getvalue().strip()))
+		if "moof" in types:
+			raise ValueError("%s is fragmented, fast start is not supported." % src_path)
+		moov = top[types.index("moov")]
+		first_mdat = types.index("mdat")
+		if types.index("moov") < first_mdat:
+			return False
+		fin.seek(moov.offset)
+		moov_data = fin.read(moov.size)
+
+		order = top[:first_mdat] + [moov] + [atom for atom in top[first_mdat:] if atom is not moov]
+		starts = [atom.offset for atom in top]
+
+		def make_shift(moov_size:int):
+			deltas = {}
+			pos = 0
+			for atom in order:
+				deltas[atom.offset] = pos - atom.offset
+				pos += moov_size if atom is moov else atom.size
+			delta_list = [deltas[start] for start in starts]
+			def shift(offsets):
+				return [o + delta_list[bisect.bisect_right(starts, o) - 1] for o in offsets]
+			return shift
+
+		# offsets are patched for an assumed moov size, which must equal the size of the patched moov
+		stable = False
+		for promote in (False, True):
+			size = moov.size
+			try:
+				for _ in range(4):
+					new_moov = patch_chunk_offsets(moov_data, make_shift(size), promote)
+					if len(new_moov) == size:
+						stable = True
+						break
+					size = len(new_moov)
+			except OverflowError:
+				continue
+			if stable:
+				break
+		if not stable:
+			raise ValueError("chunk offsets of %s can not be patched." % src_path)
+
+		with open(dst_path, "wb", buffering=0) as fout:
+			for atom in order:
+				if atom is moov:
+					fout.write(new_moov)
+				else:
+					copy_range(fin, fout, atom.offset, atom.size)
+	return True
+
+def find_atoms(atoms:List[Dict[str, Any]]|AtomTree, tp:str) -> List[Dict[str, Any]]|Iterator[Atom]:
+	"""
+	find atoms of type `tp` in pre-order.
+	an AtomTree is answered by its index as an iterator, dict atoms are searched recursively.
+	"""
+	if isinstance(atoms, AtomTree):
+		return atoms.find(tp)
 	res: List[Dict[str, Any]] = []
 	for a in atoms:
 		if a["type"] == tp:
@@ -71,17 +651,49 @@ def find_atoms(atoms:List[Dict[str, Any]], tp:str) -> List[Dict[str, Any]]:
 def show_atoms(atoms, depth:int=0):
 	columns = ["type", "size", "offset", "header_len"]
 	for atom in atoms:
-		info = f"{atom["type"]} offset:{atom["offset"]} size:{atom["size"]}"
+		info = f"{atom['type']} offset:{atom['offset']} size:{atom['size']}"
 		print(("|   " * (depth - 1) + "|___" if depth else "") + info)
 		if atom["children"]:
 			show_atoms(atom["children"], depth+1)
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Parse and show atoms of a mp4 file.")
-	parser.add_argument("File", type=str, help="Path of mp4 file.")
+	parser.add_argument("File", type=str, nargs="+", help="Path of mp4 file, directories and glob patterns are accepted with --batch.")
+	parser.add_argument("-s", "--samples", action="store_true", help="Decode sample tables and show a summary of every track.")
+	parser.add_argument("-b", "--batch", action="store_true", help="Write one NDJSON header report per file instead of showing trees.")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Worker processes of --batch.")
+	parser.add_argument("-o", "--output", type=str, default="-", help="NDJSON report file of --batch, `-` for stdout.")
+	parser.add_argument("--cache", type=str, default=None, help="NDJSON cache of --batch, unchanged files(path, size, mtime) are not parsed again.")
+	parser.add_argument("--faststart", type=str, default=None, metavar="OUTPUT", help="Rewrite the file to OUTPUT with moov before mdat.")
 	args = parser.parse_args()
 
-	with open(args.File, "rb") as f:
-		bs = f.read()
-	atoms = parse_atoms(bs)
-	show_atoms(atoms)
+	if args.faststart:
+		if faststart(args.File[0], args.faststart):
+			print(f"Moved moov of {args.File[0]} before mdat, written to {args.faststart}.")
+		else:
+			print(f"moov of {args.File[0]} is already before mdat, nothing written.")
+		sys.exit(0)
+
+	if args.batch:
+		cache = load_scan_cache(args.cache)
+		records = []
+		out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+		for record in scan_files(list(iter_media_files(args.File)), jobs=args.jobs, cache=cache):
+			out.write(json.dumps(record, ensure_ascii=False) + "\n")
+			out.flush()
+			records.append(record)
+		if out is not sys.stdout:
+			out.close()
+		if args.cache:
+			save_scan_cache(args.cache, records)
+		sys.exit(0)
+
+	for fn in args.File:
+		with open(fn, "rb") as f:
+			tree = parse_atom_tree(f)
+			show_atoms(tree.atoms)
+			if args.samples:
+				with map_file(f) as buf:
+					for index in build_sample_indexes(buf, tree):
+						keyframes = len(index) if index.sync is None else len(index.sync)
+						print(f"track {index.track_id}: {len(index)} samples, {keyframes} keyframes, {index.duration / index.timescale:.3f}s")
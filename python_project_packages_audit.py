@@ -1,20 +1,47 @@
 import argparse
 import ast
+import bisect
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import json
 import logging
 import os
+import re
+import site
+import subprocess
 import sys
+import time
 import traceback
+try:
+	import tomllib
+except ImportError:
+	tomllib = None
 
-def extra_imports(file_path:str) -> set:
+ImportRecord = collections.namedtuple("ImportRecord", ["module", "level", "kind", "lineno"])
+# kind: "import" | "conditional" | "type_checking" | "local" | "dynamic", level > 0 means relative import.
+
+IMPORT_LINE_RE = re.compile(r"^([ \t]*)(?:from[ \t]+\.*[\w.]*[ \t]+import\b|import[ \t]+[\w.])", re.M)
+COMPOUND_IMPORT_RE = re.compile(r"[:;][ \t]*(?:import|from)[ \t]")
+DYNAMIC_IMPORT_RE = re.compile(r"\b(?:import_module|__import__)\([ \t]*(['\"])([\w.]*\w)\1")
+STRING_RE = re.compile(r"""(\"\"\"|''')(?:\\.|(?!\1)[^\\])*\1|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|\#[^\n]*""", re.S)
+TYPE_CHECKING_RE = re.compile(r"(?:el)?if[ \t]+(?:\w+\.)?TYPE_CHECKING[ \t]*:")
+BLOCK_HEADER_RE = re.compile(r"(?:async[ \t]+)?(def|class|if|elif|else|try|except|finally|with|for|while|match|case)\b(?![ \t]*[=.,)\]])")
+
+def extra_imports(file_path:str, source:str|bytes=None) -> set:
 	"""
 	Extract imports from a python file.
 	Args:
 		file_path(str): python file path.
+		source(str|bytes): content of the file, read from file_path if None.
 	Returns:
 		set: all import package name in the file.
 	"""
-	with open(file_path, 'r', encoding='utf-8') as f:
-		tree = ast.parse(f.read(), filename=file_path)
+	if source is None:
+		with open(file_path, 'r', encoding='utf-8-sig') as f:
+			source = f.read()
+	tree = ast.parse(source, filename=file_path)
 
 	raw_imports = set()
 	for node in ast.walk(tree):
@@ -33,38 +60,332 @@ def extra_imports(file_path:str) -> set:
 
 	return imports
 
-def extra_all_imports(project_path:str, ignore_dirs:list=None, follow_links:bool=True, ignore_error:bool=False) -> [dict, set]:
-	all_imports = {}
-	current_packages = set()
+def import_records_ast(tree:ast.AST) -> list:
+	"""
+	Import records of a parsed module, the slow but exact path of extra_import_records.
+	"""
+	records = []
+
+	def is_type_checking(test:ast.AST) -> bool:
+		return (isinstance(test, ast.Name) and test.id == "TYPE_CHECKING") or (isinstance(test, ast.Attribute) and test.attr == "TYPE_CHECKING")
+
+	def visit(node:ast.AST, kind:str):
+		if isinstance(node, ast.Import):
+			records.extend(ImportRecord(alias.name, 0, kind, node.lineno) for alias in node.names)
+			return
+		if isinstance(node, ast.ImportFrom):
+			records.append(ImportRecord(node.module or "", node.level, kind, node.lineno))
+			return
+		if isinstance(node, ast.Call) and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str) and node.args[0].value:
+			name = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, "id", None)
+			if name in ("import_module", "__import__"):
+				records.append(ImportRecord(node.args[0].value, 0, "dynamic", node.lineno))
+		if isinstance(node, ast.If) and is_type_checking(node.test):
+			for stmt in node.body:
+				visit(stmt, "type_checking")
+			for stmt in node.orelse:
+				visit(stmt, "conditional" if kind == "import" else kind)
+			return
+		child_kind = kind
+		if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)) and kind != "type_checking":
+			child_kind = "local"
+		elif isinstance(node, (ast.If, ast.Try, ast.With, ast.AsyncWith, ast.For, ast.AsyncFor, ast.While, ast.Match, getattr(ast, "TryStar", ast.Try))) and kind == "import":
+			child_kind = "conditional"
+		for child in ast.iter_child_nodes(node):
+			visit(child, child_kind)
+
+	visit(tree, "import")
+	return records
+
+def string_spans(source:str, triple_only:bool=True) -> list:
+	"""
+	(start, end) of triple-quoted strings, or of all strings and comments.
+	"""
+	if triple_only and '"""' not in source and "'''" not in source:
+		return []
+	return [m.span() for m in STRING_RE.finditer(source) if m.group(1) or not triple_only]
 
+def in_spans(pos:int, spans:list, starts:list) -> bool:
+	i = bisect.bisect_right(starts, pos) - 1
+	return i >= 0 and pos < spans[i][1]
+
+def import_kind(source:str, line_start:int, indent:int, spans:list, starts:list) -> str:
+	"""
+	Kind of an import line by its enclosing block headers, found by walking back to less indented lines.
+	Less indented lines not starting with a block keyword are continuation lines and skipped.
+	"""
+	kind = "import"
+	while indent > 0 and line_start > 0:
+		end = line_start - 1
+		line_start = source.rfind("\n", 0, end) + 1
+		line = source[line_start:end]
+		stripped = line.lstrip(" \t")
+		level = len(line) - len(stripped)
+		if level >= indent or in_spans(line_start, spans, starts):
+			continue
+		header = BLOCK_HEADER_RE.match(stripped)
+		if header is None:
+			continue
+		indent = level
+		if TYPE_CHECKING_RE.match(stripped):
+			return "type_checking"
+		if header.group(1) == "def":
+			kind = "local"
+		elif header.group(1) != "class" and kind == "import":
+			kind = "conditional"
+	return kind
+
+def statement_end(source:str, pos:int) -> int:
+	end = source.find("\n", pos)
+	end = len(source) if end < 0 else end
+	while end < len(source):
+		statement = source[pos:end]
+		if not statement.rstrip().endswith("\\") and statement.count("(") <= statement.count(")"):
+			break
+		end = source.find("\n", end + 1)
+		end = len(source) if end < 0 else end
+	return end
+
+def extra_import_records(file_path:str, source:str|bytes=None) -> list:
+	"""
+	Extract import records with a line scanner instead of a full ast walk.
+	Only import lines are parsed by ast. The whole file is parsed as fallback
+	for ambiguous code, such as `if x: import y` or unbalanced continuation lines.
+	Returns:
+		list: ImportRecord of static, relative, conditional, TYPE_CHECKING and import_module imports.
+	"""
+	if source is None:
+		with open(file_path, 'r', encoding='utf-8-sig') as f:
+			source = f.read()
+	elif isinstance(source, bytes):
+		try:
+			source = source.decode('utf-8-sig')
+		except UnicodeDecodeError:
+			return import_records_ast(ast.parse(source, filename=file_path))
+
+	if COMPOUND_IMPORT_RE.search(source):
+		return import_records_ast(ast.parse(source, filename=file_path))
+
+	spans = string_spans(source)
+	starts = [span[0] for span in spans]
+	records = []
+	for m in IMPORT_LINE_RE.finditer(source):
+		if in_spans(m.start(), spans, starts):
+			continue
+		end = statement_end(source, m.end(1))
+		try:
+			statement = ast.parse(source[m.end(1):end])
+		except SyntaxError:
+			return import_records_ast(ast.parse(source, filename=file_path))
+		lineno = source.count("\n", 0, m.start()) + 1
+		kind = import_kind(source, m.start(), len(m.group(1)), spans, starts)
+		for node in statement.body:
+			if isinstance(node, ast.Import):
+				records.extend(ImportRecord(alias.name, 0, kind, lineno) for alias in node.names)
+			elif isinstance(node, ast.ImportFrom):
+				records.append(ImportRecord(node.module or "", node.level, kind, lineno))
+
+	dynamic = list(DYNAMIC_IMPORT_RE.finditer(source))
+	if dynamic:
+		spans = string_spans(source, triple_only=False)
+		starts = [span[0] for span in spans]
+	for m in dynamic:
+		if not in_spans(m.start(), spans, starts):
+			records.append(ImportRecord(m.group(2), 0, "dynamic", source.count("\n", 0, m.start()) + 1))
+	return records
+
+def extra_imports_fast(file_path:str, source:str|bytes=None) -> set:
+	"""
+	Same result as extra_imports, by extra_import_records.
+	"""
+	records = extra_import_records(file_path, source)
+	return {record.module.split('.')[0] for record in records if record.kind != "dynamic" and record.module}
+
+ENGINES = {"ast": extra_imports, "fast": extra_imports_fast}
+
+def file_digest(source:bytes) -> str:
+	return hashlib.blake2b(source, digest_size=16).hexdigest()
+
+def extra_file_imports(file_path:str, engine:str="ast") -> tuple:
+	"""
+	Extract imports of a file without raising, for worker processes.
+	Returns:
+		tuple: (imports, digest, None) or (None, None, (exception, traceback text)).
+	"""
+	try:
+		with open(file_path, 'rb') as f:
+			source = f.read()
+		return ENGINES[engine](file_path, source), file_digest(source), None
+	except Exception as e:
+		return None, None, (e, traceback.format_exc())
+
+# bump when the extracted imports of a file change
+IMPORT_CACHE_VERSION = 2
+
+class ImportCache:
+	"""
+	Persistent per-file imports cache in a json file.
+	A file is reused without reading if (size, mtime) is unchanged,
+	or after reading if its content hash is unchanged.
+	Entries of files not seen in the run are dropped on save,
+	all entries are dropped if the cache was written by another engine or IMPORT_CACHE_VERSION.
+	"""
+	def __init__(self, cache_path:str, engine:str="ast"):
+		self.cache_path = cache_path
+		self.engine = engine
+		self.files = {}
+		self.seen = set()
+		if os.path.exists(cache_path):
+			with open(cache_path, 'r', encoding='utf-8') as f:
+				data = json.load(f)
+			if data.get("engine") == engine and data.get("version") == IMPORT_CACHE_VERSION:
+				self.files = data["files"]
+
+	def get(self, file_path:str, stat:os.stat_result) -> set:
+		key = os.path.abspath(file_path)
+		self.seen.add(key)
+		entry = self.files.get(key)
+		if entry is None:
+			return None
+		size, mtime_ns, digest, imports = entry
+		if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+			return set(imports)
+		with open(file_path, 'rb') as f:
+			if file_digest(f.read()) != digest:
+				return None
+		entry[:2] = [stat.st_size, stat.st_mtime_ns]
+		return set(imports)
+
+	def put(self, file_path:str, stat:os.stat_result, digest:str, imports:set):
+		key = os.path.abspath(file_path)
+		self.seen.add(key)
+		self.files[key] = [stat.st_size, stat.st_mtime_ns, digest, sorted(imports)]
+
+	def save(self):
+		files = {key: entry for key, entry in self.files.items() if key in self.seen}
+		tmp_path = self.cache_path + '.tmp'
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			json.dump({"engine": self.engine, "version": IMPORT_CACHE_VERSION, "files": files}, f, separators=(',', ':'))
+		os.replace(tmp_path, self.cache_path)
+
+def walk_python_files(project_path:str, ignore_dirs:list=None, follow_links:bool=True) -> [list, set]:
+	"""
+	Python files of the project, and the module names they provide.
+	"""
+	file_paths = []
+	current_packages = set()
 	for root, dirs, files in os.walk(project_path, topdown=True, followlinks=follow_links):
-		dirs[:] = [d for d in dirs if d not in ignore_dirs]
+		dirs[:] = [d for d in dirs if d not in (ignore_dirs or [])]
 		current_packages.add(os.path.basename(root))
 
 		for fn in files:
 			if fn.endswith('.py'):
-				file_path = os.path.join(root, fn)
-				try:
-					imports = extra_imports(file_path)
-				except Exception as e:
-					if ignore_error:
-						traceback.print_exc()
-						logging.warn("Failed on file: %s" % file_name)
-						continue
-					else:
-						logging.error("Failed on file: %s" % file_name)
-						raise e
-				for item in imports:
-					all_imports[item] = all_imports.get(item, set())
-					all_imports[item].add(file_path)
+				file_paths.append(os.path.join(root, fn))
 				current_packages.add(os.path.splitext(fn)[0])
+	return file_paths, current_packages
+
+def extra_all_imports(project_path:str, ignore_dirs:list=None, follow_links:bool=True, ignore_error:bool=False, jobs:int=1, cache:ImportCache=None, engine:str="ast") -> [dict, set]:
+	"""
+	Extract imports of all python files in the project.
+	Files missed by the cache are parsed in a process pool if jobs > 1.
+	"""
+	all_imports = {}
+	file_paths, current_packages = walk_python_files(project_path, ignore_dirs, follow_links)
+
+	file_imports = {}
+	todo = []
+	stats = {}
+	for file_path in file_paths:
+		if cache is not None:
+			stats[file_path] = os.stat(file_path)
+			imports = cache.get(file_path, stats[file_path])
+			if imports is not None:
+				file_imports[file_path] = imports
+				continue
+		todo.append(file_path)
+
+	if jobs > 1 and len(todo) > 1:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+			results = list(executor.map(functools.partial(extra_file_imports, engine=engine), todo, chunksize=64))
+	else:
+		results = [extra_file_imports(file_path, engine) for file_path in todo]
+
+	for file_path, (imports, digest, error) in zip(todo, results):
+		if error is not None:
+			if ignore_error:
+				sys.stderr.write(error[1])
+				logging.warning("Failed on file: %s" % file_path)
+				continue
+			else:
+				logging.error("Failed on file: %s" % file_path)
+				raise error[0]
+		if cache is not None:
+			cache.put(file_path, stats[file_path], digest, imports)
+		file_imports[file_path] = imports
+
+	for file_path in file_paths:
+		for item in file_imports.get(file_path, ()):
+			all_imports[item] = all_imports.get(item, set())
+			all_imports[item].add(file_path)
 	return all_imports, current_packages
 
+def extra_import_kinds(project_path:str, ignore_dirs:list=None, follow_links:bool=True) -> dict:
+	"""
+	Map kind -> module -> files, for the imports which are not plain module level imports.
+	Relative imports are grouped by their own kind "relative".
+	"""
+	kinds = {}
+	for file_path in walk_python_files(project_path, ignore_dirs, follow_links)[0]:
+		try:
+			records = extra_import_records(file_path)
+		except (SyntaxError, UnicodeDecodeError, ValueError):
+			logging.warning("Failed on file: %s" % file_path)
+			continue
+		for record in records:
+			kind = "relative" if record.level else record.kind
+			if kind == "import":
+				continue
+			module = "." * record.level + record.module
+			kinds.setdefault(kind, {}).setdefault(module, set()).add("%s:%d" % (file_path, record.lineno))
+	return kinds
+
+def benchmark_engines(project_path:str, ignore_dirs:list=None, follow_links:bool=True, rounds:int=3) -> dict:
+	"""
+	Time every engine on the in-memory sources of the project, and count files where the results differ from the ast engine.
+	Returns:
+		dict: engine -> {"seconds": best round, "files_per_second": float, "mismatches": [file paths]}
+	"""
+	sources = {}
+	for file_path in walk_python_files(project_path, ignore_dirs, follow_links)[0]:
+		with open(file_path, 'rb') as f:
+			source = f.read()
+		try:
+			ast.parse(source)
+		except (SyntaxError, ValueError):
+			continue
+		sources[file_path] = source
+
+	report = {}
+	results = {}
+	for engine, extract in ENGINES.items():
+		best = None
+		for _ in range(rounds):
+			start = time.perf_counter()
+			results[engine] = {file_path: extract(file_path, source) for file_path, source in sources.items()}
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+		report[engine] = {
+			"seconds": best,
+			"files_per_second": len(sources) / best if best else 0.0,
+			"mismatches": [file_path for file_path in sources if results[engine][file_path] != results["ast"][file_path]],
+		}
+	return report
+
 def is_stdlib(module_name:str) -> bool:
 	return module_name in sys.stdlib_module_names
 
-def classify_imports(project_path:str, ignore_dirs=None, follow_links=True, ignore_error=False) -> [set, set, dict]:
-	all_imports, current_packages = extra_all_imports(project_path, ignore_dirs=ignore_dirs, follow_links=follow_links, ignore_error=ignore_error)
+def classify_imports(project_path:str, ignore_dirs=None, follow_links=True, ignore_error=False, jobs=1, cache=None, engine="ast") -> [set, set, dict]:
+	all_imports, current_packages = extra_all_imports(project_path, ignore_dirs=ignore_dirs, follow_links=follow_links, ignore_error=ignore_error, jobs=jobs, cache=cache, engine=engine)
 	imports_std = set()
 	imports_self = set()
 	imports_third = {}
@@ -77,6 +398,265 @@ def classify_imports(project_path:str, ignore_dirs=None, follow_links=True, igno
 			imports_third[module_name] = all_imports[module_name]
 	return imports_std, imports_self, imports_third
 
+REQUIREMENT_NAME_RE = re.compile(r"^[ \t]*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+def normalize_dist_name(name:str) -> str:
+	return re.sub(r"[-_.]+", "-", name).lower()
+
+def site_dirs() -> list:
+	dirs = site.getsitepackages() + [site.getusersitepackages()]
+	return [d for d in dict.fromkeys(dirs) if os.path.isdir(d)]
+
+def read_dist_meta(meta_path:str) -> [str, str]:
+	"""
+	Name and Version from the header of a METADATA or PKG-INFO file.
+	"""
+	name = version = None
+	with open(meta_path, 'r', encoding='utf-8', errors='replace') as f:
+		for line in f:
+			if not line.strip():
+				break
+			key, _, value = line.partition(":")
+			if key == "Name":
+				name = value.strip()
+			elif key == "Version":
+				version = value.strip()
+	return name, version
+
+def record_top_levels(record_path:str) -> set:
+	"""
+	Top-level importable names from the file list of a RECORD or installed-files.txt.
+	"""
+	top_levels = set()
+	with open(record_path, 'r', encoding='utf-8', errors='replace') as f:
+		for line in f:
+			path = line.split(",", 1)[0].strip().replace("\\", "/")
+			if not path or path.startswith(("..", "/")):
+				continue
+			first, sep, _ = path.partition("/")
+			if sep:
+				if not first.endswith((".dist-info", ".egg-info", ".data")) and first not in ("__pycache__", "bin") and first.isidentifier():
+					top_levels.add(first)
+			elif first.endswith((".py", ".so", ".pyd")):
+				module = first.split(".", 1)[0]
+				if module.isidentifier():
+					top_levels.add(module)
+	return top_levels
+
+def scan_dists(site_dir:str) -> dict:
+	"""
+	Map top-level module name -> [[distribution name, version], ...] of the distributions installed in site_dir.
+	top_level.txt is preferred, the file list of RECORD is used if missing.
+	"""
+	modules = {}
+	with os.scandir(site_dir) as entries:
+		for entry in entries:
+			if entry.name.endswith(".dist-info"):
+				meta_path = os.path.join(entry.path, "METADATA")
+				record_path = os.path.join(entry.path, "RECORD")
+			elif entry.name.endswith(".egg-info") and entry.is_dir():
+				meta_path = os.path.join(entry.path, "PKG-INFO")
+				record_path = os.path.join(entry.path, "installed-files.txt")
+			else:
+				continue
+			if not os.path.isfile(meta_path):
+				continue
+			name, version = read_dist_meta(meta_path)
+			if not name:
+				continue
+			top_level_path = os.path.join(entry.path, "top_level.txt")
+			if os.path.isfile(top_level_path):
+				with open(top_level_path, 'r', encoding='utf-8') as f:
+					top_levels = {line.strip().split("/")[0] for line in f if line.strip()}
+			elif os.path.isfile(record_path):
+				top_levels = record_top_levels(record_path)
+			else:
+				top_levels = {name.replace("-", "_").lower()}
+			for module in top_levels:
+				if [name, version] not in modules.setdefault(module, []):
+					modules[module].append([name, version])
+	return modules
+
+class DistIndex:
+	"""
+	Map top-level module names to installed distributions, built once for all the site directories.
+	The scan of a site directory is cached in a json file until the mtime of the directory changes,
+	which happens when a distribution is installed or removed.
+	"""
+	def __init__(self, dirs:list=None, cache_path:str=None):
+		self.dirs = dirs if dirs is not None else site_dirs()
+		self.cache_path = cache_path
+		self.modules = {}
+		cached = {}
+		if cache_path and os.path.exists(cache_path):
+			with open(cache_path, 'r', encoding='utf-8') as f:
+				cached = json.load(f)
+		changed = False
+		scans = {}
+		for site_dir in self.dirs:
+			mtime_ns = os.stat(site_dir).st_mtime_ns
+			entry = cached.get(site_dir)
+			if entry is None or entry["mtime_ns"] != mtime_ns:
+				entry = {"mtime_ns": mtime_ns, "modules": scan_dists(site_dir)}
+				changed = True
+			scans[site_dir] = entry
+			for module, dists in entry["modules"].items():
+				for dist in dists:
+					if dist not in self.modules.setdefault(module, []):
+						self.modules[module].append(dist)
+		if cache_path and (changed or set(scans) != set(cached)):
+			tmp_path = cache_path + '.tmp'
+			try:
+				os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+				with open(tmp_path, 'w', encoding='utf-8') as f:
+					json.dump(scans, f, separators=(',', ':'))
+				os.replace(tmp_path, cache_path)
+			except OSError as e:
+				logging.warning("Failed to write the distribution cache %s: %s" % (cache_path, e))
+
+	def lookup(self, module_name:str) -> list:
+		"""
+		[(distribution name, version), ...] providing the module, empty if unknown.
+		"""
+		return [tuple(dist) for dist in self.modules.get(module_name, ())]
+
+def read_declared_dependencies(project_path:str) -> dict:
+	"""
+	Map normalized distribution name -> declaring file, from requirements*.txt and pyproject.toml in the project root.
+	"""
+	declared = {}
+	for fn in sorted(os.listdir(project_path)):
+		file_path = os.path.join(project_path, fn)
+		if fn.startswith("requirements") and fn.endswith(".txt"):
+			with open(file_path, 'r', encoding='utf-8') as f:
+				for line in f:
+					line = line.split("#", 1)[0]
+					m = REQUIREMENT_NAME_RE.match(line)
+					if m and not line.lstrip().startswith("-"):
+						declared.setdefault(normalize_dist_name(m.group(1)), fn)
+		elif fn == "pyproject.toml":
+			if tomllib is None:
+				logging.warning("tomllib is not available, skip %s" % file_path)
+				continue
+			with open(file_path, 'rb') as f:
+				project = tomllib.load(f).get("project", {})
+			requirements = list(project.get("dependencies", []))
+			for extra in project.get("optional-dependencies", {}).values():
+				requirements.extend(extra)
+			for requirement in requirements:
+				m = REQUIREMENT_NAME_RE.match(requirement)
+				if m:
+					declared.setdefault(normalize_dist_name(m.group(1)), fn)
+	return declared
+
+def resolve_distributions(imports_third:dict, index:DistIndex, declared:dict=None) -> [dict, list, dict, dict]:
+	"""
+	Map third-party imports to installed distributions and compare with declared dependencies.
+	Returns:
+		dict: distribution name -> version, of the used distributions.
+		list: imported modules not provided by any installed distribution.
+		dict: used but undeclared distribution name -> modules, empty if declared is None.
+		dict: declared but unused normalized name -> declaring file, empty if declared is None.
+	"""
+	used = {}
+	unresolved = []
+	modules_of = {}
+	for module_name in sorted(imports_third):
+		dists = index.lookup(module_name)
+		if not dists:
+			unresolved.append(module_name)
+		for name, version in dists:
+			used[name] = version
+			modules_of.setdefault(name, []).append(module_name)
+	undeclared = {}
+	unused = {}
+	if declared is not None:
+		used_names = {normalize_dist_name(name) for name in used}
+		undeclared = {name: modules_of[name] for name in sorted(used) if normalize_dist_name(name) not in declared}
+		unused = {name: declared[name] for name in sorted(declared) if name not in used_names}
+	return used, unresolved, undeclared, unused
+
+IMPORTTIME_RE = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)")
+
+def parse_importtime(text:str) -> list:
+	"""
+	Parse the `-X importtime` output into a tree.
+	Children are printed before their parent, one indent level of 2 spaces deeper.
+	Returns:
+		list: top level nodes {"name", "self_us", "cumulative_us", "children"} in import order.
+	"""
+	stack = []
+	for line in text.splitlines():
+		m = IMPORTTIME_RE.match(line)
+		if m is None:
+			continue
+		level = (len(m.group(3)) - 1) // 2
+		node = {"name": m.group(4), "self_us": int(m.group(1)), "cumulative_us": int(m.group(2)), "children": []}
+		while stack and stack[-1][0] > level:
+			node["children"].insert(0, stack.pop()[1])
+		stack.append((level, node))
+	return [node for _, node in stack]
+
+def profile_import(module_name:str, project_path:str=None, python:str=sys.executable, timeout:float=120) -> dict:
+	"""
+	Measure the cold import of a module in a new interpreter with `-X importtime`.
+	Modules already imported by the interpreter startup are not counted.
+	The project root is put first on sys.path so self modules can be imported, their top level code runs.
+	Returns:
+		dict: the node of module_name, or {"name", "error"} if the import failed.
+	"""
+	env = dict(os.environ)
+	if project_path:
+		env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.abspath(project_path), env.get("PYTHONPATH")]))
+	try:
+		proc = subprocess.run([python, "-X", "importtime", "-c", "import %s" % module_name], env=env, cwd=project_path, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=timeout)
+	except subprocess.TimeoutExpired:
+		return {"name": module_name, "error": "timeout after %ds" % timeout}
+	if proc.returncode != 0:
+		lines = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+		return {"name": module_name, "error": lines[-1] if lines else "exit code %d" % proc.returncode}
+	for node in parse_importtime(proc.stderr):
+		if node["name"] == module_name:
+			return node
+	return {"name": module_name, "self_us": 0, "cumulative_us": 0, "children": []}
+
+def profile_imports(module_names:list, project_path:str=None, repeat:int=1) -> dict:
+	"""
+	Profile every module in its own interpreter, keep the fastest of repeat runs.
+	"""
+	profiles = {}
+	for module_name in sorted(module_names):
+		for _ in range(repeat):
+			node = profile_import(module_name, project_path)
+			best = profiles.get(module_name)
+			if best is None or "error" in best or ("error" not in node and node["cumulative_us"] < best["cumulative_us"]):
+				profiles[module_name] = node
+	return profiles
+
+def format_import_tree(node:dict, depth:int, min_us:int=0, indent:int=0) -> list:
+	if "error" in node:
+		return ["%s%10s  %s (%s)" % ("  " * indent, "failed", node["name"], node["error"])]
+	lines = ["%s%8.1f ms  %s" % ("  " * indent, node["cumulative_us"] / 1000, node["name"])]
+	if depth > 0:
+		for child in sorted(node["children"], key=lambda child: -child["cumulative_us"]):
+			if child["cumulative_us"] >= min_us:
+				lines.extend(format_import_tree(child, depth - 1, min_us, indent + 1))
+	return lines
+
+def import_cost_by_file(profiles:dict, imports_third:dict) -> dict:
+	"""
+	Map importing file -> (total cumulative us, [(module, cumulative us), ...]) of the third-party modules it imports.
+	Modules shared by several files are counted in each of them, modules failed to import are skipped.
+	"""
+	files = {}
+	for module_name, file_paths in imports_third.items():
+		if "cumulative_us" not in profiles.get(module_name, {}):
+			continue
+		cost = profiles[module_name]["cumulative_us"]
+		for file_path in file_paths:
+			files.setdefault(file_path, []).append((module_name, cost))
+	return {file_path: (sum(cost for _, cost in modules), sorted(modules, key=lambda item: -item[1])) for file_path, modules in files.items()}
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Analyze a Python project, extract all imported packages, list the package names, and classify them into standard libraries, self-contained, and third-party packages.")
 	parser.add_argument("Project", type=str, help="The Python project root path.")
@@ -95,10 +675,33 @@ if __name__ == '__main__':
 	parser.add_argument("-l", "--follow-links", action="store_true", help="Follow the symbolic link in the project folder.")
 	parser.add_argument("-e", "--ignore-error", action="store_true", help="Skip any errors when extract imports info.")
 	parser.add_argument("-t", "--show-third-distribution", action="store_true", help="Show the files where third-party packages are imported.")
+	parser.add_argument("-j", "--jobs", type=int, default=1, help="Parse python files in JOBS processes.")
+	parser.add_argument("-c", "--cache", type=str, default=None, help="Json file to cache the imports of every file between runs.")
+	parser.add_argument("--engine", choices=sorted(ENGINES), default="fast", help="Import extraction engine, fast scans import lines and falls back to ast on ambiguous code.")
+	parser.add_argument("-k", "--show-kinds", action="store_true", help="Show relative, conditional, TYPE_CHECKING, function local and import_module imports.")
+	parser.add_argument("-d", "--distributions", action="store_true", help="Map third-party imports to installed distributions, and check them against requirements*.txt and pyproject.toml.")
+	parser.add_argument("--site-dir", action="append", default=None, type=str, help="Site directory of the environment to resolve distributions in, default the running one.", metavar="DIR")
+	parser.add_argument("--dist-cache", type=str, default=os.path.join(os.path.expanduser("~"), ".cache", "python_project_packages_audit.dists.json"), help="Json file to cache the distribution index, empty to disable.")
+	parser.add_argument("-p", "--profile-imports", action="store_true", help="Measure the cold import time of every third-party and self package in a new interpreter, the top level code of self modules is executed.")
+	parser.add_argument("--profile-depth", type=int, default=2, help="Levels of submodules shown in the import time tree.")
+	parser.add_argument("--profile-min-ms", type=float, default=1.0, help="Hide submodules faster than this in the import time tree.")
+	parser.add_argument("--profile-repeat", type=int, default=1, help="Import every package REPEAT times and keep the fastest.", metavar="REPEAT")
+	parser.add_argument("--benchmark", type=int, nargs="?", const=3, default=None, help="Compare the engines on the project in ROUNDS rounds and exit.", metavar="ROUNDS")
 	args = parser.parse_args()
 	assert os.path.isdir(args.Project)
 
-	imports_std, imports_self, imports_third = classify_imports(args.Project, ignore_dirs=args.ignore_dirs, follow_links=args.follow_links, ignore_error=args.ignore_error)
+	if args.benchmark:
+		report = benchmark_engines(args.Project, ignore_dirs=args.ignore_dirs, follow_links=args.follow_links, rounds=args.benchmark)
+		for engine, result in report.items():
+			print("%-5s %8.3fs %10.1f files/s %5.2fx, %d mismatches" % (engine, result["seconds"], result["files_per_second"], report["ast"]["seconds"] / result["seconds"], len(result["mismatches"])))
+			for file_path in result["mismatches"]:
+				print("\t", file_path)
+		sys.exit(1 if any(result["mismatches"] for result in report.values()) else 0)
+
+	cache = ImportCache(args.cache, args.engine) if args.cache else None
+	imports_std, imports_self, imports_third = classify_imports(args.Project, ignore_dirs=args.ignore_dirs, follow_links=args.follow_links, ignore_error=args.ignore_error, jobs=args.jobs, cache=cache, engine=args.engine)
+	if cache:
+		cache.save()
 	print("\nIMPORT STDLIB %d:\n\t" % len(imports_std), imports_std)
 	print("\nIMPORT SELF %d:\n\t" % len(imports_self), imports_self)
 	print("\nIMPORT THIRD %d:\n\t" % len(imports_third), imports_third.keys())
@@ -106,3 +709,35 @@ if __name__ == '__main__':
 		print("="*10, "Third-party Package Distribution", "="*10)
 		for item in imports_third:
 			print("\n%s be imported in %d files:\n\t" % (item, len(imports_third[item])), imports_third[item])
+	if args.distributions:
+		index = DistIndex(args.site_dir, args.dist_cache or None)
+		declared = read_declared_dependencies(args.Project)
+		used, unresolved, undeclared, unused = resolve_distributions(imports_third, index, declared if declared else None)
+		print("="*10, "Third-party Distributions", "="*10)
+		for name in sorted(used, key=str.lower):
+			print("%s==%s" % (name, used[name]))
+		if unresolved:
+			print("\nUNRESOLVED %d:\n\t" % len(unresolved), unresolved)
+		if not declared:
+			print("\nNo requirements*.txt or pyproject.toml dependencies found in the project root.")
+		else:
+			print("\nUSED BUT UNDECLARED %d:" % len(undeclared))
+			for name in undeclared:
+				print("\t%s (imported as %s)" % (name, ", ".join(undeclared[name])))
+			print("\nDECLARED BUT UNUSED %d:" % len(unused))
+			for name in unused:
+				print("\t%s (in %s)" % (name, unused[name]))
+	if args.profile_imports:
+		profiles = profile_imports(list(imports_third) + list(imports_self), args.Project, repeat=args.profile_repeat)
+		ordered = sorted(profiles.values(), key=lambda node: -node.get("cumulative_us", -1))
+		print("="*10, "Import Time by Package", "="*10)
+		for node in ordered:
+			print("\n".join(format_import_tree(node, args.profile_depth, int(args.profile_min_ms * 1000))))
+		print("="*10, "Third-party Import Time by File", "="*10)
+		for file_path, (total, modules) in sorted(import_cost_by_file(profiles, imports_third).items(), key=lambda item: -item[1][0]):
+			print("%8.1f ms  %s\n\t" % (total / 1000, file_path), ", ".join("%s %.1f ms" % (module_name, cost / 1000) for module_name, cost in modules))
+	if args.show_kinds:
+		for kind, modules in extra_import_kinds(args.Project, ignore_dirs=args.ignore_dirs, follow_links=args.follow_links).items():
+			print("="*10, "%s imports" % kind, "="*10)
+			for module in sorted(modules):
+				print("\n%s:\n\t" % module, sorted(modules[module]))